@@ -14,43 +14,315 @@ import os
 import argparse
 import logging
 import json
-import shutil
 import time
 import datetime
 import glob
-
-
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s,%(msecs)d %(levelname)-8s %(message)s',
-    datefmt='%Y-%m-%d:%H:%M:%S',
-    level=logging.INFO
-)
+import collections
+import hashlib
+import hmac
+import io
+import ipaddress
+import functools
+import contextlib
+import codecs
+# sqlite3, mmap, gzip, zipfile and concurrent.futures are imported when
+# first needed, a filter or library use does not pay for them
+try:
+    import re._parser as sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_parse
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory is not reported
+    resource = None
+
+
+logger = logging.getLogger('VeeamLogAnonymizer')
+
+# Configure logging, only when run as a script: importing the module leaves
+# the logging configuration of the application alone
+def configure_logging():
+    logging.basicConfig(
+        format='%(asctime)s,%(msecs)d %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d:%H:%M:%S',
+        level=logging.INFO
+    )
 
 # Define custom logging functions
 def stdlog(msg):
     '''Standard info logging'''
-    logging.info(msg)
+    logger.info(msg)
 
 def dbglog(msg):
     '''Debug logging'''
-    logging.debug(msg)
+    logger.debug(msg)
 
 def errlog(msg):
     '''Error logging'''
-    logging.error(msg)
+    logger.error(msg)
 
-def generate_random_string(length=12):
+def generate_random_string(length=12, value=None, key=None):
+    '''Random pseudonym, or the pseudonym of value derived from key in keyed mode'''
     characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    if key is None or value is None:
+        return ''.join(random.choices(characters, k=length))
+    return keyed_string(key, value, length)
+
+
+def keyed_string(key, value, length=12):
+    '''Pseudonym of a value derived from a key (HMAC-SHA256)'''
+    characters = string.ascii_letters + string.digits
+    # Keyed mode: the pseudonym only depends on the key and the value, values
+    # are matched case-insensitively so they are derived from the lowercase form
+    digest = hmac.new(key, value.lower().encode('utf-8'), hashlib.sha256).digest()
+    number = int.from_bytes(digest, 'big')
+    result = []
+    for _ in range(length):
+        number, index = divmod(number, len(characters))
+        result.append(characters[index])
+    return ''.join(result)
+
+
+def read_pseudonym_key(key_file=None):
+    '''Return the pseudonymization key of --key-file or VEEAM_ANONYMIZER_KEY, None if unset'''
+    if key_file:
+        with open(key_file, 'rb') as file:
+            key = file.read().strip()
+    else:
+        key = os.environ.get('VEEAM_ANONYMIZER_KEY', '').encode('utf-8')
+    return key or None
+
+def trie_regex(words):
+    '''Build a regular expression matching the longest of the given words'''
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        expression = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional group: the longest word is tried first
+        if '' in node:
+            expression = '(?:' + expression + ')?'
+        return expression
+
+    return build(trie)
+
+
+class DomainTrie:
+    '''Suffix trie of the known domains, walked from the top level label'''
+
+    def __init__(self, domains=()):
+        self.root = {}
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        node = self.root
+        for label in reversed(domain.lower().split('.')):
+            node = node.setdefault(label, {})
+        node[''] = None
+
+    def longest_suffix(self, labels):
+        '''Return the number of labels of the longest known domain ending labels, 0 if none'''
+        node = self.root
+        found = 0
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label.lower())
+            if node is None:
+                break
+            if '' in node:
+                found = depth
+        return found
+
+
+# Characters of the labels of a host name
+HOST_CHARACTERS = frozenset(string.ascii_letters + string.digits + '-.')
+
+
+def host_start(content, start, end):
+    '''Start of the host labels of a FQDN whose domain is at [start, end) of content
+
+    Return start when the domain is not preceded by host labels, or is part
+    of a longer name.
+    '''
+    following = content[end:end + 2]
+    if following and (following[0].isalnum() or following[0] in '_-'):
+        return start
+    if following[:1] == '.' and len(following) > 1 and (following[1].isalnum() or following[1] in '_-'):
+        return start
+    position = start - 1
+    while position > 0 and content[position - 1] in HOST_CHARACTERS:
+        position -= 1
+    dots = content.rfind('..', position, start)
+    if dots >= 0:
+        position = dots + 2
+    while position < start and content[position] in '.-':
+        position += 1
+    if position > 0 and (content[position - 1].isalnum() or content[position - 1] == '_'):
+        return start
+    return position
+
+
+class Replacer:
+    '''Replace all the mapped values of a text in a single pass
+
+    With domains, any FQDN under one of these domains is rewritten label by
+    label: the host labels get a pseudonym derived from salt, unless they are
+    mapped values, and the domain gets its own pseudonym. The FQDN are found
+    from the domains matched by the same scan, looking back for host labels.
+    '''
+
+    def __init__(self, mappings, categories=None, domains=(), salt=None):
+        self.table = {}
+        self.folded = {}
+        self.categories = {}
+        for index, (original, replacement) in enumerate(mappings):
+            if not original:
+                continue
+            # The first mapping of a value wins, as with the former sequential replacements
+            self.table.setdefault(original.lower(), replacement)
+            self.folded.setdefault(original.casefold(), replacement)
+            if categories:
+                self.categories.setdefault(original.casefold(), categories[index])
+        self.domains = None
+        self.salt = salt or os.urandom(16)
+        self.hosts = {}
+        if domains:
+            self.domains = DomainTrie(domain for domain in domains if domain)
+        self.pattern = re.compile(trie_regex(self.table), re.IGNORECASE) if self.table else None
+        self.lower_pattern = None
+        self.leak_pattern = None
+
+    def ascii_words(self):
+        '''Case sensitive bytes pattern of the ASCII mapped values, or False
+
+        The values of the table are lowercase: a lowercase copy of ASCII bytes
+        is searched several times faster than with IGNORECASE. Values with
+        other characters cannot appear in ASCII content.
+        '''
+        if self.leak_pattern is None:
+            words = [word for word in self.table if word.isascii()]
+            self.leak_pattern = re.compile(trie_regex(words).encode('ascii')) if words else False
+        return self.leak_pattern
+
+    def search_ascii(self, content):
+        '''Search the mapped values in ASCII bytes, without decoding them'''
+        pattern = self.ascii_words()
+        return bool(pattern) and pattern.search(content.lower()) is not None
+
+    def leaks(self, chunk, offset=0, encoding='utf-8'):
+        '''Return the (offset, category) of the mapped values left in a bytes chunk read at offset'''
+        if self.pattern is None:
+            return []
+        if encoding == 'utf-8' and chunk.isascii():
+            pattern = self.ascii_words()
+            if not pattern:
+                return []
+            return [(offset + match.start(), self.categories.get(match.group(0).decode('ascii'), 'Other'))
+                    for match in pattern.finditer(chunk.lower())]
+        text = chunk.decode(encoding, log_errors(encoding))
+        found = []
+        position = 0
+        for match in self.pattern.finditer(text):
+            # Offsets are in bytes, only the text before a leak is encoded again
+            offset += len(text[position:match.start()].encode(encoding, log_errors(encoding)))
+            position = match.start()
+            found.append((offset, self.categories.get(match.group(0).casefold(), 'Other')))
+        return found
+
+    def value(self, found):
+        new_value = self.table.get(found.lower()) or self.folded[found.casefold()]
+        if stats:
+            stats.replacements[self.categories.get(found.casefold(), 'Other')] += 1
+        return new_value if found.islower() else new_value.upper()
+
+    def host(self, label):
+        '''Pseudonym of a host label of a FQDN, the same for every FQDN'''
+        if label.lower() in self.table:
+            return self.value(label)
+        key = label.lower()
+        if key not in self.hosts:
+            self.hosts[key] = keyed_string(self.salt, 'Host:' + key)
+        if stats:
+            stats.replacements['Host names'] += 1
+        return self.hosts[key] if label.islower() else self.hosts[key].upper()
+
+    def fqdn(self, found):
+        labels = found.split('.')
+        cut = len(labels) - self.domains.longest_suffix(labels)
+        if cut == len(labels):
+            return self.value(found)
+        # A mapped value ending the FQDN (an SMTP server) is replaced as a whole
+        for index in range(cut):
+            if '.'.join(labels[index:]).lower() in self.table:
+                cut = index
+                break
+        return '.'.join([self.host(label) for label in labels[:cut]] + [self.value('.'.join(labels[cut:]))])
+
+    def spans(self, content):
+        '''Yield the (start, end) of the mapped values in content'''
+        if not content.isascii():
+            for match in self.pattern.finditer(content):
+                yield match.span()
+            return
+        if self.lower_pattern is None:
+            # As for leaks(): a lowercase copy of ASCII text is searched
+            # several times faster than the text with IGNORECASE
+            words = [word for word in self.table if word.isascii()]
+            self.lower_pattern = re.compile(trie_regex(words)) if words else False
+        if self.lower_pattern:
+            for match in self.lower_pattern.finditer(content.lower()):
+                yield match.span()
+
+    def sub(self, content):
+        if self.pattern is None:
+            return content
+        # re.sub() written out: the host labels before a domain are already
+        # output when the domain is matched, they are taken back. The pieces
+        # keep their start in content, ~start for the replaced ones.
+        texts = []
+        starts = []
+        last = 0
+        for start, end in self.spans(content):
+            if start > last:
+                starts.append(last)
+                texts.append(content[last:start])
+            if self.domains is not None and start and content[start - 1] == '.':
+                host = host_start(content, start, end)
+                if host < start and self.domains.longest_suffix(content[start:end].split('.')):
+                    index = len(starts)
+                    while index and (starts[index - 1] if starts[index - 1] >= 0 else ~starts[index - 1]) >= host:
+                        index -= 1
+                    if index:
+                        piece_end = (starts[index] if starts[index] >= 0 else ~starts[index]) if index < len(starts) else start
+                        if piece_end > host and starts[index - 1] < 0:
+                            # A replaced value overlaps the host labels
+                            host = start
+                        elif piece_end > host:
+                            texts[index - 1] = content[starts[index - 1]:host]
+                    if host < start:
+                        del starts[index:]
+                        del texts[index:]
+                        starts.append(~host)
+                        texts.append(self.fqdn(content[host:end]))
+                        last = end
+                        continue
+            starts.append(~start)
+            texts.append(self.value(content[start:end]))
+            last = end
+        if not starts:
+            return content
+        texts.append(content[last:])
+        return ''.join(texts)
 
-def replace_string_in_file(input, output, old_value, new_value):
-    with open(input, 'r') as file:
-        content = file.read()
-    pattern = re.compile(re.escape(old_value), re.IGNORECASE)
-    content = pattern.sub(lambda match: new_value if match.group(0).islower() else new_value.upper(), content)
-    with open(output, 'w') as file:
-        file.write(content)
 
 def check_log_contains_line(input_file, line_to_check):
     with open(input_file, 'r') as file:
@@ -92,57 +364,1747 @@ def anonymized_IPv4(ip):
     return masked_ip
 
 
-def process_IP(input_file, output_file):
-    # Define a regular expression pattern to match IP addresses
-    ip_pattern = r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b(?!])"
-
-    # Read the file
-    with open(input_file, 'r', encoding='utf-8', errors='ignore') as file:
-        content = file.read()
-
-    # Find all IP addresses in the content using regex
-    ip_addresses = re.findall(ip_pattern, content)
-
-    # Replace the first two numbers with "*"
-    for ip in ip_addresses:
-        # Exception for VMware vSphere version 
-        if not ip.startswith(('7.', '8.')):
-            content = content.replace(ip, anonymized_IPv4(ip))
-
-    ### another pattern :( 
-    ip_pattern = r'\[::ffff:([\d.]+)\]'
-    ip_addresses = re.findall(ip_pattern, content)
-    for ip in ip_addresses:
-        # Exception for VMware vSphere version 
-        if not ip.startswith(('7.', '8.')):
-            content = content.replace(ip, anonymized_IPv4(ip))
-    # Write the modified content back to the file
-    with open(output_file, 'w') as file:
-        file.write(content)
-    
-def find_pattern(pattern_key,log_file_path,):
+def anonymized_IPv6(ip):
+    '''Mask the network prefix (first four groups) of an IPv6 address, the
+    interface identifier keeps its compressed form'''
+    groups = [group.lstrip("0") or "0" for group in ipaddress.IPv6Address(ip).exploded.split(":")[4:]]
+    # The longest run of two zero groups or more is written "::"
+    run_start, run_length = 0, 0
+    for index in range(len(groups)):
+        length = 0
+        while index + length < len(groups) and groups[index + length] == "0":
+            length += 1
+        if length > run_length:
+            run_start, run_length = index, length
+    if run_length >= 2:
+        masked_ip = ":".join(["****"] * 4 + groups[:run_start]) + "::" + ":".join(groups[run_start + run_length:])
+    else:
+        masked_ip = ":".join(["****"] * 4 + groups)
+    return masked_ip.upper() if ip.isupper() else masked_ip
+
+
+# IPv4 addresses not followed by "]"
+IPV4_PATTERN = re.compile(r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b(?!])")
+IPV4_HINT = re.compile(r"\.\d{1,3}\.\d{1,3}\.\d")
+# IPv4 addresses followed by "]" (version numbers too), only masked once
+# the address was found elsewhere
+IPV4_BRACKETED_PATTERN = re.compile(r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?=])")
+# IPv4 mapped addresses "[::ffff:x.x.x.x]"
+IPV4_MAPPED_PATTERN = re.compile(r"(\[::ffff:)([\d.]+)\]")
+# IPv6 candidates with at least one hex digit, not in a path ("C:\a::b"),
+# checked with the ipaddress module before being masked. Addresses ending
+# with a dotted IPv4 part are left to the IPv4 patterns.
+IPV6_PATTERN = re.compile(r"(?<![\w:.\\/])(?=:*[0-9A-Fa-f])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}(?![\w:.])")
+# Eight groups of two hex digits: a Fibre Channel WWN or an EUI-64
+WWN_PATTERN = re.compile(r"[0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){7}")
+# Two colons around a group, but not the minutes of a "hh:mm:ss" timestamp
+IPV6_HINT = re.compile(r"::|:[0-9A-Fa-f]{1,4}:(?!\d\d\b)")
+
+
+def iter_hinted(pattern, hint, run_chars, run_limit, content, pos=0, endpos=None):
+    '''Same as pattern.finditer(content, pos, endpos) for a pattern that always
+    matches at the start of a run of run_chars and contains a match of hint.
+
+    sre only skips ahead quickly for patterns starting with a literal, so hint
+    (starting with one) finds the candidates and pattern is tried at the start
+    of the run, at most run_limit characters before.
+    '''
+    if endpos is None:
+        endpos = len(content)
+    while True:
+        found = hint.search(content, pos, endpos)
+        if found is None:
+            return
+        start = found.start()
+        floor = max(pos, start - run_limit)
+        while start > floor and content[start - 1] in run_chars:
+            start -= 1
+        match = pattern.match(content, start, endpos)
+        if match is None:
+            pos = found.start() + 1
+            continue
+        yield match
+        pos = match.end()
+
+
+def sub_hinted(pattern, hint, run_chars, run_limit, repl, content):
+    '''Same as pattern.sub(repl, content), with the conditions of iter_hinted()'''
+    parts = []
+    last = 0
+    for match in iter_hinted(pattern, hint, run_chars, run_limit, content):
+        parts.append(content[last:match.start()])
+        parts.append(repl(match))
+        last = match.end()
+    if not parts:
+        return content
+    parts.append(content[last:])
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=65536)
+def mask_IP(ip):
+    '''Return the masked form of an IP address, or the address unchanged'''
+    if "." in ip:
+        # Exception for VMware vSphere version
+        if ip.startswith(('7.', '8.')):
+            return ip
+        return anonymized_IPv4(ip)
     try:
-        with open("patterns.json", "r") as patterns_file:
-            patterns_dict = json.load(patterns_file)
-        
-        pattern = patterns_dict.get(pattern_key)
-        if not pattern:
-            return f"Pattern key '{pattern_key}' not found in patterns.json."
+        address = ipaddress.IPv6Address(ip)
+    except ValueError:
+        # Not an IPv6 address (MAC addresses, durations, ...)
+        return ip
+    # Nothing to hide in "::" and "::1", a WWN is not an address
+    if address.is_unspecified or address.is_loopback or WWN_PATTERN.fullmatch(ip):
+        return ip
+    return anonymized_IPv6(ip)
+
+
+def mask_IP_match(match):
+    ip = match.group()
+    masked = mask_IP(ip)
+    if masked != ip and stats:
+        stats.replacements['IPv4 address' if '.' in ip else 'IPv6 address'] += 1
+    return masked
+
+
+def mask_IPv4_mapped_match(match):
+    ip = match.group(2)
+    masked = mask_IP(ip)
+    if masked != ip and stats:
+        stats.replacements['IPv4 address'] += 1
+    return match.group(1) + masked + "]"
+
 
-        with open(log_file_path, "r", encoding='utf-8', errors='ignore') as log_file:
-            log_content = log_file.read()
+def mask_bracketed_IPv4_match(addresses, match):
+    ip = match.group()
+    if ip not in addresses:
+        return ip
+    if stats:
+        stats.replacements['IPv4 address'] += 1
+    return mask_IP(ip)
 
-        matches = re.findall(pattern, log_content)
-        matches = list(set(matches))
 
-        if matches:
-            return matches
+# Bytes versions of the IPv4 patterns, to find the addresses of a memory-mapped log
+IPV4_PATTERN_ASCII = re.compile(IPV4_PATTERN.pattern.encode('ascii'))
+IPV4_HINT_ASCII = re.compile(IPV4_HINT.pattern.encode('ascii'))
+IPV4_MAPPED_PATTERN_ASCII = re.compile(IPV4_MAPPED_PATTERN.pattern.encode('ascii'))
+
+
+# Key of the find_IPv4() addresses of a log among its collected entities,
+# they are not added to the mapping but given to mask_IPs() for this log
+ADDRESSES = 'IPv4 addresses'
+
+
+def find_IPv4(content, pos=0, endpos=None):
+    '''Return the IPv4 addresses masked in content (a str, or the ASCII bytes
+    of a log), unbracketed or IPv4 mapped, in order of appearance
+
+    Their "x.x.x.x]" copies are masked as well by mask_IPs(), in the whole
+    log, as the replacement of every occurrence of a found address did.
+    '''
+    if isinstance(content, str):
+        patterns = IPV4_PATTERN, IPV4_HINT, string.digits, IPV4_MAPPED_PATTERN
+    else:
+        patterns = IPV4_PATTERN_ASCII, IPV4_HINT_ASCII, string.digits.encode('ascii'), IPV4_MAPPED_PATTERN_ASCII
+    pattern, hint, digits, mapped = patterns
+    found = {}
+    with measured('find IPv4'):
+        for match in iter_hinted(pattern, hint, digits, 3, content, pos, endpos):
+            found[decode_value(match.group())] = None
+        for match in mapped.finditer(content, pos, len(content) if endpos is None else endpos):
+            found[decode_value(match.group(2))] = None
+    return [ip for ip in found if mask_IP(ip) != ip]
+
+
+def mask_IPs(content, addresses=()):
+    '''Mask the IPv4 and IPv6 addresses of the content
+
+    addresses are the find_IPv4() addresses of the whole log the content is
+    part of, their "x.x.x.x]" copies (like versions) are masked too.
+    '''
+    with measured('mask IPv4'):
+        content = sub_hinted(IPV4_PATTERN, IPV4_HINT, string.digits, 3, mask_IP_match, content)
+        content = IPV4_MAPPED_PATTERN.sub(mask_IPv4_mapped_match, content)
+        if addresses:
+            content = sub_hinted(IPV4_BRACKETED_PATTERN, IPV4_HINT, string.digits, 3,
+                                 functools.partial(mask_bracketed_IPv4_match, addresses), content)
+    with measured('mask IPv6'):
+        return sub_hinted(IPV6_PATTERN, IPV6_HINT, string.hexdigits + ":", 40, mask_IP_match, content)
+
+
+def iter_chunks(file, chunk_size=None):
+    '''Yield the content of a text or binary file in chunks cut at line boundaries
+
+    Without chunk_size the whole file is returned at once. A single line
+    longer than chunk_size is cut at chunk_size.
+    '''
+    if not chunk_size:
+        yield file.read()
+        return
+    pending = None
+    while True:
+        data = file.read(chunk_size)
+        if not data:
+            break
+        if pending:
+            data = pending + data
+        cut = data.rfind(b'\n' if isinstance(data, bytes) else '\n') + 1
+        if not cut:
+            cut = len(data)
+        yield data[:cut]
+        pending = data[cut:]
+    if pending:
+        yield pending
+
+
+EntityMatch = collections.namedtuple('EntityMatch', ['kind', 'value', 'start', 'end'])
+
+
+def required_literal(pattern):
+    '''Return the longest literal contained in every match of a compiled pattern
+    and whether the matches start with it, ('', False) when there is none'''
+    if pattern.flags & re.IGNORECASE:
+        return pattern.pattern[:0], False
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (re.error, TypeError):
+        return pattern.pattern[:0], False
+    best, best_is_prefix = [], False
+    run, run_is_prefix = [], True
+    # Only the top level items of the pattern are mandatory
+    for op, value in list(parsed) + [(None, None)]:
+        if op == sre_parse.LITERAL:
+            run.append(value)
+            continue
+        if len(run) > len(best):
+            best, best_is_prefix = run, run_is_prefix
+        # Anchors and word boundaries do not consume characters
+        run_is_prefix = run_is_prefix and not run and op == sre_parse.AT
+        run = []
+    if isinstance(pattern.pattern, bytes):
+        return bytes(best), best_is_prefix
+    return ''.join(map(chr, best)), best_is_prefix
+
+
+def decode_value(value):
+    '''Decode a value matched in the bytes of a UTF-8 log as open_log() reads it'''
+    if isinstance(value, tuple):
+        return tuple(map(decode_value, value))
+    if isinstance(value, str):
+        # Empty groups are already ''
+        return value
+    return value.decode('utf-8', 'surrogateescape')
+
+
+class EntityScanner:
+    '''Extract every entity type of patterns.json from a log read once'''
+
+    def __init__(self, patterns, digest=None, warnings=()):
+        self.kinds = list(patterns)
+        self.sources = dict(patterns)
+        self.digest = digest
+        self.warnings = list(warnings)
+        self.patterns = {kind: re.compile(pattern) for kind, pattern in patterns.items()}
+        self.literals = {kind: required_literal(pattern) for kind, pattern in self.patterns.items()}
+        self.mapped_patterns = None
+        self.mapped_literals = None
+
+    def __reduce__(self):
+        # A worker process compiles the pack once, from its source
+        if self.digest is None:
+            return EntityScanner, (self.sources,)
+        return compile_patterns, (self.sources,)
+
+    def compile_mapped(self):
+        '''Compile the bytes version of the patterns, used over memory-mapped logs'''
+        if self.mapped_patterns is None:
+            self.mapped_patterns = {kind: re.compile(pattern.encode('utf-8')) for kind, pattern in self.sources.items()}
+            self.mapped_literals = {kind: required_literal(pattern) for kind, pattern in self.mapped_patterns.items()}
+        return self.mapped_patterns
+
+    @staticmethod
+    def match_value(match, count):
+        # Same result shape as re.findall()
+        if count == 0:
+            return match.group(0)
+        if count == 1:
+            return match.group(1) or ''
+        return tuple(value or '' for value in match.groups())
+
+    def entity_value(self, match):
+        value = self.match_value(match, match.re.groups)
+        if isinstance(match.re.pattern, bytes):
+            # Only the matched values of a memory-mapped log are decoded
+            return decode_value(value)
+        return value
+
+    def scan(self, content, offset=0, last_end=None, endpos=None):
+        '''Return an EntityMatch for every pattern match, findall() semantics per kind
+
+        Positions are shifted by offset and the content is considered to end
+        at endpos. last_end keeps, for each kind, the end of its last match so
+        that a chunked scan skips what was already found.
+        '''
+        if last_end is None:
+            last_end = dict.fromkeys(self.kinds, 0)
+        if endpos is None:
+            endpos = len(content)
+        if isinstance(content, str):
+            patterns, literals = self.patterns, self.literals
         else:
+            # bytes or a memory-mapped log
+            patterns, literals = self.compile_mapped(), self.mapped_literals
+        found = []
+        # Each pattern keeps its own scan: a combined alternation would lose
+        # the literal prefix search of the re engine and is much slower
+        for kind, pattern in patterns.items():
+            started = time.perf_counter()
+            count = len(found)
+            position = max(0, last_end[kind] - offset)
+            literal, is_prefix = literals[kind]
+            if literal:
+                # A substring search rules out the content without the literal
+                # of the pattern, the regex only runs from its first occurrence
+                first = content.find(literal, position, endpos)
+                if first < 0:
+                    position = endpos
+                elif is_prefix:
+                    position = first
+            for match in pattern.finditer(content, position, endpos):
+                last_end[kind] = offset + match.end()
+                found.append(EntityMatch(kind, self.entity_value(match), offset + match.start(), offset + match.end()))
+            if stats:
+                stats.add(stats.patterns, kind, time.perf_counter() - started, len(found) - count)
+        found.sort(key=lambda entity: entity.start)
+        return found
+
+    def collect(self, content):
+        '''Return the unique values found for each kind, in order of appearance
+
+        content is a str, or the bytes of a log (bytes or mmap). The IPv4
+        addresses of the content are under ADDRESSES.
+        '''
+        found = self.unique_values(self.scan(content))
+        found[ADDRESSES] = find_IPv4(content)
+        return found
+
+    def scan_chunks(self, chunks, overlap=65536):
+        '''Yield the matches of the successive chunks of a log
+
+        Only complete lines are scanned, an unfinished line waits for the next
+        chunk unless it is longer than overlap. The last lines of a chunk (up
+        to overlap characters) are scanned again with the next one, so matches
+        spanning a chunk boundary are found.
+        '''
+        last_end = dict.fromkeys(self.kinds, 0)
+        tail = ''
+        offset = 0
+        for chunk in chunks:
+            content = tail + chunk
+            end = content.rfind('\n') + 1
+            if len(content) - end > overlap:
+                end = len(content)
+            yield from self.scan(content, offset, last_end, end)
+            keep = max(0, end - overlap)
+            if keep:
+                keep = min(end, content.find('\n', keep) + 1 or keep)
+            tail = content[keep:]
+            offset += keep
+        if tail:
+            yield from self.scan(tail, offset, last_end)
+
+    def collect_chunks(self, chunks, overlap=65536):
+        '''collect() over the successive chunks of a log, cut at line ends'''
+        addresses = {}
+
+        def scanned():
+            for chunk in chunks:
+                addresses.update(dict.fromkeys(find_IPv4(chunk)))
+                yield chunk
+
+        found = self.unique_values(self.scan_chunks(scanned(), overlap))
+        found[ADDRESSES] = list(addresses)
+        return found
+
+    def unique_values(self, entities):
+        result = {kind: {} for kind in self.kinds}
+        for entity in entities:
+            result[entity.kind][entity.value] = None
+        return {kind: list(values) for kind, values in result.items()}
+
+
+# patterns.json is shipped next to the script, whatever the working directory
+PATTERNS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'patterns.json')
+
+# Named pattern packs (per Veeam version or product): patterns/NAME.json
+PATTERNS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'patterns')
+
+# Kinds of entities added to the mapping, the values of other kinds are
+# collected but not anonymized
+MAPPED_KINDS = ('VeeamServer', 'SMTPServer', 'VeeamUser', 'vCenter', 'ESXiServer', 'Location', 'Email')
+
+# Compiled pattern packs of the process, by content hash
+pattern_packs = {}
+
+
+def pattern_pack_names():
+    '''Return the names of the available pattern packs, default is patterns.json'''
+    names = ['default']
+    if os.path.isdir(PATTERNS_DIRECTORY):
+        names.extend(sorted(name[:-5] for name in os.listdir(PATTERNS_DIRECTORY) if name.endswith('.json')))
+    return names
+
+
+def pattern_pack_path(name=None):
+    '''Return the file of a pattern pack given by name or path'''
+    if not name or name == 'default':
+        return PATTERNS_FILE
+    if os.path.isfile(name):
+        return name
+    path = os.path.join(PATTERNS_DIRECTORY, name + '.json')
+    if not os.path.isfile(path):
+        raise ValueError('unknown pattern pack ' + name + ' (available: ' + ', '.join(pattern_pack_names()) + ')')
+    return path
+
+
+def unbounded_repeats(items):
+    '''Yield the unbounded repeats of a parsed pattern and whether they hold
+    another unbounded repeat, like (a+)+ that backtracks exponentially'''
+    for op, value in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            inner = list(unbounded_repeats(value[2]))
+            yield from inner
+            if value[1] == sre_parse.MAXREPEAT:
+                yield op, bool(inner)
+            continue
+        # Groups, alternatives and lookarounds hold sub-patterns
+        for part in value if isinstance(value, (tuple, list)) else [value]:
+            if isinstance(part, sre_parse.SubPattern):
+                yield from unbounded_repeats(part)
+            elif isinstance(part, list):
+                for branch in part:
+                    if isinstance(branch, sre_parse.SubPattern):
+                        yield from unbounded_repeats(branch)
+
+
+def validate_patterns(patterns):
+    '''Check a pattern pack, return its warnings
+
+    Raise ValueError when the pack cannot be used: not a {kind: regex}
+    object, a regex that does not compile or that matches an empty string.
+    '''
+    if not isinstance(patterns, dict) or not patterns:
+        raise ValueError('a pattern pack is a non empty {"kind": "regex"} object')
+    warnings = []
+    for kind, pattern in patterns.items():
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError(kind + ': the pattern must be a non empty string')
+        try:
+            compiled = re.compile(pattern)
+        except re.error as e:
+            raise ValueError(kind + ': ' + str(e))
+        if compiled.search('') is not None:
+            raise ValueError(kind + ': the pattern matches an empty string')
+        if compiled.groups == 0:
+            warnings.append(kind + ': no capture group, the whole match is the value')
+        if kind not in MAPPED_KINDS:
+            warnings.append(kind + ': not a kind of the mapping (' + ', '.join(MAPPED_KINDS) + '), its values are not anonymized')
+        if any(nested for _, nested in unbounded_repeats(sre_parse.parse(pattern))):
+            warnings.append(kind + ': nested unbounded repeats, it may backtrack exponentially on malformed lines')
+        if not required_literal(compiled)[0]:
+            warnings.append(kind + ': no literal text, the regex runs over every character of the logs')
+    return warnings
+
+
+def compile_patterns(patterns):
+    '''Validate and compile a pattern pack, once per process for the same content'''
+    digest = hashlib.sha256(json.dumps(patterns).encode('utf-8')).hexdigest()
+    if digest not in pattern_packs:
+        warnings = validate_patterns(patterns)
+        pattern_packs[digest] = EntityScanner(patterns, digest, warnings)
+    return pattern_packs[digest]
+
+
+def load_patterns(path=None):
+    '''Load and compile the pattern packs once for the whole run
+
+    path is the name or the file of a pack, or a list of them whose kinds
+    are merged in order (a later pack replaces the pattern of a kind).
+    '''
+    patterns = {}
+    for name in path if isinstance(path, (list, tuple)) else [path]:
+        with open(pattern_pack_path(name), 'r') as patterns_file:
+            patterns.update(json.load(patterns_file))
+    return compile_patterns(patterns)
+
+
+class FileRange(io.RawIOBase):
+    '''Raw binary stream over the byte range [start, end) of a file, of the
+    decompressed content for a gzip log or a zip archive member'''
+
+    def __init__(self, path, start, end):
+        super().__init__()
+        if is_compressed(path):
+            self.file = CompressedLog(path)
+            # Decompressed and dropped up to start
+            self.file.stream.seek(start)
+        else:
+            self.file = open(path, 'rb')
+            self.file.seek(start)
+        self.remaining = max(0, end - start)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        read = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining -= read
+        return read
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def archive_member(log_file_path):
+    '''Split "bundle.zip!dir/job.log" in ("bundle.zip", "dir/job.log"), the member is None for a file'''
+    index = log_file_path.lower().find('.zip!')
+    if index < 0:
+        return log_file_path, None
+    return log_file_path[:index + 4], log_file_path[index + 5:]
+
+
+def is_compressed(log_file_path):
+    '''Tell if a log is gzip compressed or a zip archive member'''
+    return log_file_path.endswith('.gz') or archive_member(log_file_path)[1] is not None
+
+
+def is_log_name(name):
+    '''Tell if a file name is a log: job.log or a gzip log like job.log.gz or job.log.1.gz'''
+    return name.endswith('.log') or (name.endswith('.gz') and '.log' in name)
+
+
+# Zip archives opened by this process, by path, and the process they belong to
+zip_archives = {}
+zip_archives_pid = None
+
+
+def open_archive(archive_path):
+    '''The zip archive at archive_path, opened once per process
+
+    Its central directory is read once: the sizes of the members and the
+    members themselves are then found without reading it again. The
+    archives inherited from a parent process are opened again, they share
+    the file offset of the parent.
+    '''
+    global zip_archives_pid
+    if zip_archives_pid != os.getpid():
+        zip_archives.clear()
+        zip_archives_pid = os.getpid()
+    archive = zip_archives.get(archive_path)
+    if archive is None:
+        import zipfile
+        archive = zip_archives[archive_path] = zipfile.ZipFile(archive_path)
+    return archive
+
+
+def list_archive(archive_path):
+    '''Return the logs of a zip archive as "bundle.zip!member" paths'''
+    return [archive_path + '!' + info.filename for info in open_archive(archive_path).infolist()
+            if not info.is_dir() and is_log_name(info.filename)]
+
+
+def log_size(log_file_path):
+    '''Size of a log, uncompressed for a zip archive member'''
+    archive, member = archive_member(log_file_path)
+    if member is None:
+        return os.path.getsize(log_file_path)
+    return open_archive(archive).getinfo(member).file_size
+
+
+class CompressedLog(io.RawIOBase):
+    '''Raw binary stream over a gzip log or a zip archive member, decompressed on the fly'''
+
+    def __init__(self, path):
+        import gzip
+        super().__init__()
+        archive, member = archive_member(path)
+        self.files = []
+        if member is None:
+            self.stream = gzip.open(path, 'rb')
+            return
+        # The archive stays open for its other members
+        self.stream = open_archive(archive).open(member)
+        if member.endswith('.gz'):
+            self.files.append(self.stream)
+            self.stream = gzip.GzipFile(fileobj=self.stream)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            for file in reversed(self.files):
+                file.close()
+        super().close()
+
+
+class EvenLog(io.RawIOBase):
+    '''Raw binary stream of a UTF-16 log without its trailing odd byte
+
+    A log copied while it is written can end in the middle of a code unit,
+    which cannot be decoded. This byte is kept in trailing once the log is
+    read to its end, to be written back unchanged.
+    '''
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.pending = b''
+        self.trailing = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            data = self.stream.read(max(2, len(buffer)) - len(self.pending))
+            if not data:
+                # Read again at the end by the text layer, the byte is kept
+                if self.pending:
+                    self.trailing, self.pending = self.pending, b''
+                return 0
+            data = self.pending + data
+            size = len(data) - len(data) % 2
+            self.pending = data[size:]
+            if size:
+                buffer[:size] = data[:size]
+                return size
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+        super().close()
+
+
+def trailing_byte(log_file):
+    '''The trailing odd byte of a UTF-16 log opened by open_log() and read to its end'''
+    return getattr(log_file.buffer.raw, 'trailing', b'')
+
+
+def write_trailing(outfile, data):
+    '''Write the trailing_byte() of a log after its text, written by outfile'''
+    if data:
+        outfile.flush()
+        outfile.buffer.write(data)
+
+
+# Byte order marks of the UTF-16 logs written by some Windows tools
+UTF16_BOMS = {codecs.BOM_UTF16_LE: 'utf-16-le', codecs.BOM_UTF16_BE: 'utf-16-be'}
+
+
+def log_encoding(log_file_path):
+    '''Encoding of a log from its first bytes: 'utf-16-le' or 'utf-16-be' for a
+    UTF-16 log, with or without a byte order mark, 'utf-8' for the others'''
+    with open_binary_log(log_file_path) as log_file:
+        head = log_file.read(4096)
+    if head[:2] in UTF16_BOMS:
+        return UTF16_BOMS[head[:2]]
+    # Without a mark, the NUL high bytes of ASCII characters give it away,
+    # NUL padding of a log cut by a crash is on both sides
+    odd, even = head[1::2].count(0), head[0::2].count(0)
+    if abs(odd - even) * 4 > len(head):
+        return 'utf-16-le' if odd > even else 'utf-16-be'
+    return 'utf-8'
+
+
+def log_errors(encoding):
+    '''Error handler decoding and encoding a log losslessly: bytes invalid in
+    UTF-8 and unpaired UTF-16 surrogates are written back unchanged'''
+    return 'surrogateescape' if encoding == 'utf-8' else 'surrogatepass'
+
+
+def open_binary_log(log_file_path, start=None, end=None):
+    '''Open a log, or the byte range [start, end) of it, as a binary stream'''
+    if start is not None:
+        return io.BufferedReader(FileRange(log_file_path, start, end))
+    if is_compressed(log_file_path):
+        return io.BufferedReader(CompressedLog(log_file_path))
+    return open(log_file_path, 'rb')
+
+
+def open_log(log_file_path, start=None, end=None):
+    '''Open a log, or the byte range [start, end) of it, as text
+
+    gzip logs and zip archive members are decompressed while they are read,
+    their range is in decompressed bytes. The log is decoded in its own
+    encoding (ranges are only made of UTF-8 logs) without loss: line ends
+    are kept and atomic_output() with the same encoding writes the bytes
+    back unchanged, but for the trailing_byte() of a UTF-16 log of odd size.
+    '''
+    encoding = 'utf-8' if start is not None else log_encoding(log_file_path)
+    stream = open_binary_log(log_file_path, start, end)
+    if encoding != 'utf-8':
+        stream = io.BufferedReader(EvenLog(stream))
+    return io.TextIOWrapper(stream, encoding=encoding, errors=log_errors(encoding), newline='')
+
+
+def split_file(log_file_path, size, start=0, end=None):
+    '''Return the (start, end) byte ranges of a log, or of its byte range
+    [start, end), cut after a line end every size bytes'''
+    total = os.path.getsize(log_file_path) if end is None else end
+    ranges = []
+    with open(log_file_path, 'rb') as file:
+        while start < total:
+            end = start + size
+            if end >= total:
+                end = total
+            else:
+                file.seek(end - 1)
+                line = b''
+                while not line.endswith(b'\n'):
+                    line = file.readline(65536)
+                    if not line:
+                        break
+                end = min(file.tell(), total)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# Timestamp at the start of a Veeam log line: [16.10.2026 10:15:31.000],
+# after the byte order mark for the first line of a UTF-8 log with one
+LINE_TIME_PATTERN = re.compile(rb'^(?:\xef\xbb\xbf)?\[(\d\d)\.(\d\d)\.(\d{4}) (\d\d):(\d\d):(\d\d)', re.MULTILINE)
+
+# Below this size the window of a log is searched line by line
+TIME_SEARCH_BLOCK = 65536
+
+
+def time_key(moment):
+    '''Comparable key (b'yyyymmddhhmmss') of a datetime or of a LINE_TIME_PATTERN match'''
+    if isinstance(moment, datetime.datetime):
+        return moment.strftime('%Y%m%d%H%M%S').encode('ascii')
+    day, month, year, hour, minute, second = moment.groups()
+    return year + month + day + hour + minute + second
+
+
+def parse_time(value):
+    '''Parse a --since/--until time: "2026-10-16 10:15[:31]", the log format
+    "16.10.2026 10:15[:31]", a date alone or a duration before now ("6h",
+    "30m", "2d"), in the local time of the logs'''
+    value = value.strip()
+    duration = re.fullmatch(r'(\d+)\s*([smhd])', value)
+    if duration:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[duration.group(2)]
+        return time_key(datetime.datetime.now() - datetime.timedelta(**{unit: int(duration.group(1))}))
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d',
+                        '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y'):
+        try:
+            return time_key(datetime.datetime.strptime(value, time_format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('invalid time: ' + value + ' (expected YYYY-MM-DD [HH:MM[:SS]], DD.MM.YYYY [HH:MM[:SS]] or a duration like 6h)')
+
+
+def line_times(log_file_path, start, end):
+    '''Yield the (offset, key) of the timestamped lines of a log starting in
+    the byte range [start, end), the line cut by start is skipped'''
+    with open_binary_log(log_file_path, max(start - 1, 0), end + 32) as log_file:
+        position = max(start - 1, 0)
+        if start:
+            position += len(log_file.readline())
+        for chunk in iter_chunks(log_file, TIME_SEARCH_BLOCK):
+            for match in LINE_TIME_PATTERN.finditer(chunk):
+                if position + match.start() >= end:
+                    return
+                yield position + match.start(), time_key(match)
+            position += len(chunk)
+
+
+def time_offset(log_file_path, size, key, after=False):
+    '''Offset of the first line of a log whose timestamp is at key or later
+    (later than key with after), size if none
+
+    The log is binary searched, its lines are expected in time order the way
+    Veeam writes them; lines without a timestamp belong to the previous one.
+    '''
+    low, high = 0, size
+    result = size
+    while high - low > TIME_SEARCH_BLOCK:
+        middle = (low + high) // 2
+        probe = next(line_times(log_file_path, middle, high), None)
+        if probe is None:
+            # Nothing but continuation lines up to high
+            high = middle
+        elif probe[1] > key or (probe[1] == key and not after):
+            high = result = probe[0]
+        else:
+            low = probe[0] + 1
+    for offset, line_key in line_times(log_file_path, low, high):
+        if line_key > key or (line_key == key and not after):
+            return offset
+    return result
+
+
+def time_window(log_file_path, since=None, until=None):
+    '''Return the byte range (start, end) of the lines of a log logged
+    between the since and until keys, None when there is none
+
+    A plain log is binary searched, only a few blocks of it are read. A
+    compressed log cannot seek, it is decompressed up to the end of the
+    window and its range is in decompressed bytes. The lines before the
+    first timestamp go with the first timestamped line; a log without any
+    timestamp cannot be placed in time, it is kept whole.
+    '''
+    if is_compressed(log_file_path):
+        first = None
+        start = 0 if since is None else None
+        end = None
+        position = 0
+        with open_binary_log(log_file_path) as log_file:
+            for chunk in iter_chunks(log_file, 1024 * 1024):
+                for match in LINE_TIME_PATTERN.finditer(chunk):
+                    line_key = time_key(match)
+                    if first is None:
+                        first = position + match.start()
+                    if start is None and line_key >= since:
+                        start = position + match.start()
+                    if until is not None and line_key > until:
+                        end = position + match.start()
+                        break
+                if end is not None:
+                    break
+                position += len(chunk)
+        size = position
+        if end is None:
+            end = position
+        if start is None:
+            start = end
+    else:
+        size = os.path.getsize(log_file_path)
+        first = next(line_times(log_file_path, 0, size), (None,))[0]
+        start = 0 if since is None else time_offset(log_file_path, size, since)
+        end = size if until is None else time_offset(log_file_path, size, until, after=True)
+    if first is None:
+        start, end = 0, size
+    if start == first:
+        start = 0
+    if end == first:
+        end = 0
+    return (start, end) if start < end else None
+
+
+def map_log(log_file_path):
+    '''Memory-map a log read only, None for an empty log (it cannot be mapped)'''
+    import mmap
+    with open(log_file_path, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
             return None
-    except FileNotFoundError:
-        return f"Error: File '{log_file_path}' not found."
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
+        return mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Bytes the bytes patterns match as the text patterns do: ASCII but the
+# separators \x1c-\x1f, which \s only matches in text
+MAPPED_SAFE_BYTES = bytes(range(0x1c)) + bytes(range(0x20, 0x80))
+
+
+def mappable(log_file_path):
+    '''Tell whether the bytes patterns of --mmap find in a log the same
+    entities as the text patterns, checked by blocks without decoding it
+
+    Spaces, word characters and word boundaries only match ASCII in bytes
+    patterns: a log with other characters (a non-breaking space after
+    "HostName:", an accented letter ending an email address) is scanned
+    decoded.
+    '''
+    if is_compressed(log_file_path) or log_encoding(log_file_path) != 'utf-8':
+        return False
+    mapping = map_log(log_file_path)
+    if mapping is None:
+        return True
+    with mapping:
+        block = 1024 * 1024
+        for position in range(0, len(mapping), block):
+            if mapping[position:position + block].translate(None, MAPPED_SAFE_BYTES):
+                return False
+    return True
+
+
+def collect_file(scanner, log_file_path, chunk_size=None, mapped=False):
+    '''Collect the entities of a log, chunk by chunk when chunk_size is set
+
+    With mapped the bytes patterns run over the memory-mapped log, the log
+    is neither decoded nor copied, unless they could find other entities
+    than in the decoded log (see mappable()).
+    '''
+    if mapped and mappable(log_file_path):
+        mapping = map_log(log_file_path)
+        if mapping is None:
+            return scanner.collect(b'')
+        with mapping:
+            return scanner.collect(mapping)
+    with open_log(log_file_path) as log_file:
+        return scanner.collect_chunks(iter_chunks(log_file, chunk_size))
+
+
+def collect_range(scanner, log_file_path, start, end, chunk_size=None, overlap=65536, mapped=False):
+    '''Scan the byte range [start, end) of a log
+
+    The scan goes on overlap bytes further so that a match starting in the
+    range and ending after it is complete. Return the length in characters
+    (in bytes with mapped) of the range and its matches, positions relative
+    to the range start, and its IPv4 addresses (the range is made of whole
+    lines, so are the addresses). mapped is decided for the whole log, with
+    mappable(), all its ranges must be scanned the same way.
+    '''
+    if mapped:
+        mapping = map_log(log_file_path)
+        if mapping is None:
+            return 0, [], []
+        with mapping:
+            matches = scanner.scan(mapping, 0, dict.fromkeys(scanner.kinds, start), min(len(mapping), end + overlap))
+            addresses = find_IPv4(mapping, start, min(len(mapping), end))
+        matches = [match._replace(start=match.start - start, end=match.end - start) for match in matches]
+        return end - start, range_matches(matches, end - start), addresses
+
+    length = 0
+    addresses = {}
+
+    def chunks():
+        nonlocal length
+        with open_log(log_file_path, start, end) as log_file:
+            for chunk in iter_chunks(log_file, chunk_size):
+                length += len(chunk)
+                addresses.update(dict.fromkeys(find_IPv4(chunk)))
+                yield chunk
+        with open_log(log_file_path, end, end + overlap) as log_file:
+            yield from iter_chunks(log_file, chunk_size)
+
+    matches = list(scanner.scan_chunks(chunks(), overlap))
+    return length, range_matches(matches, length), list(addresses)
+
+
+def range_matches(matches, length):
+    '''The matches starting in a range of length, the ones of the overlap
+    scanned after it belong to the next range and are counted there'''
+    if stats:
+        for match in matches:
+            if match.start >= length:
+                stats.add(stats.patterns, match.kind, 0, -1)
+    return [match for match in matches if match.start < length]
+
+
+def merge_ranges(scanner, log_file_path, ranges, results, overlap=65536, mapped=False):
+    '''Join the collect_range() results of a log as if it was scanned at once'''
+    found = {kind: {} for kind in scanner.kinds}
+    offsets = []
+    offset = 0
+    addresses = {}
+    for length, _, range_addresses in results:
+        offsets.append(offset)
+        offset += length
+        addresses.update(dict.fromkeys(range_addresses))
+    patterns = scanner.compile_mapped() if mapped else scanner.patterns
+    for kind, pattern in patterns.items():
+        last_end = 0
+        for (start, end), base, (length, matches, _) in zip(ranges, offsets, results):
+            matches = [match for match in matches if match.kind == kind]
+            position = 0
+            while position < len(matches) and base + matches[position].start < last_end:
+                position += 1
+            accepted = []
+            if position and base + matches[position - 1].end > last_end:
+                # The range was scanned from a match hidden by the previous
+                # range, search again from the real position until both agree
+                if mapped:
+                    with open(log_file_path, 'rb') as log_file:
+                        log_file.seek(start)
+                        content = log_file.read(end + overlap - start)
+                else:
+                    with open_log(log_file_path, start, end + overlap) as log_file:
+                        content = log_file.read()
+                known = {(match.start, match.end): index for index, match in enumerate(matches)}
+                position = len(matches)
+                for match in pattern.finditer(content, last_end - base):
+                    if match.start() >= length:
+                        break
+                    if (match.start(), match.end()) in known:
+                        position = known[(match.start(), match.end())]
+                        break
+                    accepted.append(EntityMatch(kind, scanner.entity_value(match), match.start(), match.end()))
+            accepted.extend(matches[position:])
+            for match in accepted:
+                found[kind][match.value] = None
+            if accepted:
+                last_end = max(last_end, base + accepted[-1].end)
+    found[ADDRESSES] = addresses
+    return {kind: list(values) for kind, values in found.items()}
+
+
+# Bytes versions of the IP hints, to look for addresses without decoding
+IP_HINTS_ASCII = [re.compile(IPV4_HINT.pattern.encode('ascii')), re.compile(IPV6_HINT.pattern.encode('ascii'))]
+
+
+def needs_anonymization(replacer, input, start=None, end=None, block_size=1024 * 1024):
+    '''Tell whether a log, or its byte range [start, end), may hold a mapped
+    value or an IP address, without decoding it
+
+    The log is read by blocks, in a bounded buffer, up to the first block
+    holding something to anonymize. Consecutive blocks overlap by the length
+    of the longest value, a value cut by a block end is found in the next one.
+    Logs with non ASCII content always need the text processing: case
+    insensitive matching of Unicode text cannot be done on the bytes. So
+    do UTF-16 logs, their bytes do not hold the values as they are.
+    '''
+    if log_encoding(input) != 'utf-8':
+        return True
+    overlap = max(64, max(map(len, replacer.table), default=0)) - 1
+    tail = b''
+    with open_binary_log(input, start, end) as infile:
+        while True:
+            data = infile.read(block_size)
+            if not data:
+                return False
+            if not data.isascii():
+                return True
+            data = tail + data
+            # The IP hints are cheap, the mapped values are searched last
+            if any(hint.search(data) for hint in IP_HINTS_ASCII) or replacer.search_ascii(data):
+                return True
+            tail = data[-overlap:]
+
+
+def copy_range(input, outfile, start=None, end=None):
+    '''Copy the byte range [start, end) of a file to outfile, in the kernel when possible'''
+    with open(input, 'rb') as infile:
+        offset = start or 0
+        if end is None:
+            end = os.fstat(infile.fileno()).st_size
+        outfile.flush()
+        try:
+            while offset < end:
+                if hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(infile.fileno(), outfile.fileno(), end - offset, offset)
+                else:
+                    copied = os.sendfile(outfile.fileno(), infile.fileno(), offset, end - offset)
+                if not copied:
+                    break
+                offset += copied
+        except (OSError, AttributeError):
+            # Not supported by the platform or between these file systems
+            infile.seek(offset)
+            while offset < end:
+                data = infile.read(min(1024 * 1024, end - offset))
+                if not data:
+                    break
+                outfile.write(data)
+                offset += len(data)
+
+
+@contextlib.contextmanager
+def atomic_output(output, mode='w', encoding=None):
+    '''Write a file through a temporary file renamed over output once complete
+
+    Text written to a .gz output is gzip compressed. With the encoding of a
+    log, text read by open_log() is written back as the same bytes.
+    '''
+    temporary = output + '.tmp'
+    options = {} if encoding is None else {'encoding': encoding, 'errors': log_errors(encoding), 'newline': ''}
+    try:
+        if output.endswith('.gz') and 'b' not in mode:
+            import gzip
+            with open(temporary, 'wb') as outfile, gzip.GzipFile(os.path.basename(output), 'wb', fileobj=outfile) as gzip_file, io.TextIOWrapper(gzip_file, **options) as text:
+                yield text
+        else:
+            with open(temporary, mode, **options) as outfile:
+                yield outfile
+        os.replace(temporary, output)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+
+
+def anonymize_file(input, output, replacer, chunk_size=None, start=None, end=None, addresses=()):
+    '''Replace the mapped values and mask the IP addresses of a log
+
+    With chunk_size the log is streamed and the output written incrementally.
+    With start and end only this byte range of the log is anonymized.
+    addresses are the IPv4 addresses collected from the whole log.
+    A log without anything to anonymize is copied as is, without decoding.
+    The output is only written once, through a temporary file, in the
+    encoding of the log: only the anonymized values differ from the input.
+    '''
+    if not is_compressed(input) and not needs_anonymization(replacer, input, start, end):
+        with measured('pass-through'), atomic_output(output, 'wb') as outfile:
+            copy_range(input, outfile, start, end)
+        return
+    with open_log(input, start, end) as infile, atomic_output(output, encoding=infile.encoding) as outfile:
+        for chunk in iter_chunks(infile, chunk_size):
+            with measured('replace'):
+                chunk = replacer.sub(chunk)
+            outfile.write(mask_IPs(chunk, addresses))
+        write_trailing(outfile, trailing_byte(infile))
+
+
+def verify_file(replacer, output, chunk_size, start=None, end=None):
+    '''Return the (offset, category) of the mapped values left in an anonymized
+    log, or in its byte range [start, end)
+
+    The log is read once, by chunks, and not decoded when it is ASCII. The
+    offsets are in bytes, of the decompressed log for a compressed one. A
+    UTF-16 log is cut at its own line ends, read as text.
+    '''
+    encoding = 'utf-8' if start is not None else log_encoding(output)
+    found = []
+    offset = start or 0
+    with open_binary_log(output, start, end) if encoding == 'utf-8' else open_log(output) as infile:
+        for chunk in iter_chunks(infile, chunk_size):
+            if isinstance(chunk, str):
+                chunk = chunk.encode(encoding, log_errors(encoding))
+            with measured('verify'):
+                found.extend(replacer.leaks(chunk, offset, encoding))
+            offset += len(chunk)
+    return found
+
+
+def write_archive(output, members):
+    '''Write a zip archive of the anonymized (temporary file, member name) members'''
+    import zipfile
+    with atomic_output(output, 'wb') as outfile, zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path, member in members:
+            # gzip members are already compressed
+            archive.write(path, member, zipfile.ZIP_STORED if member.endswith('.gz') else None)
+    for path, _ in members:
+        os.remove(path)
+
+
+def join_parts(parts, output):
+    '''Concatenate the anonymized parts of a log into its output file'''
+    with atomic_output(output, 'wb') as outfile:
+        for part in parts:
+            copy_range(part, outfile)
+    for part in parts:
+        os.remove(part)
+
+
+class Stats:
+    '''Timings and counters of a run, written as a JSON report with --stats'''
+
+    def __init__(self):
+        self.phases = {}
+        self.operations = {}
+        self.patterns = {}
+        self.replacements = collections.Counter()
+        self.files = {}
+        self.last = time.perf_counter()
+
+    @staticmethod
+    def add(table, name, seconds, count=1):
+        entry = table.setdefault(name, [0, 0.0])
+        entry[0] += count
+        entry[1] += seconds
+
+    def lap(self, name):
+        '''Add the time elapsed since the previous lap to the phase name'''
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def file(self, path, step, size, seconds):
+        entry = self.files.setdefault(path, {'collect': [0, 0.0], 'anonymize': [0, 0.0], 'verify': [0, 0.0]})
+        entry[step][0] += size
+        entry[step][1] += seconds
+
+    def drain(self):
+        '''Return the counters gathered by a worker process since the last call'''
+        drained = Stats()
+        drained.__dict__, self.__dict__ = self.__dict__, drained.__dict__
+        return drained
+
+    def merge(self, other):
+        for table in ('operations', 'patterns'):
+            for name, (count, seconds) in getattr(other, table).items():
+                self.add(getattr(self, table), name, seconds, count)
+        self.replacements.update(other.replacements)
+        for path, steps in other.files.items():
+            for step, (size, seconds) in steps.items():
+                self.file(path, step, size, seconds)
+
+    def report(self, wall_seconds, **details):
+        def throughput(size, seconds):
+            return round(size / 1e6 / seconds, 3) if seconds else None
+
+        report = dict(details)
+        report['wall_seconds'] = round(wall_seconds, 6)
+        report['phases'] = {name: round(seconds, 6) for name, seconds in self.phases.items()}
+        report['operations'] = {name: {'calls': count, 'seconds': round(seconds, 6)} for name, (count, seconds) in self.operations.items()}
+        report['patterns'] = {name: {'matches': count, 'seconds': round(seconds, 6)} for name, (count, seconds) in self.patterns.items()}
+        report['replacements'] = dict(self.replacements.most_common())
+        report['files'] = []
+        for path, steps in self.files.items():
+            entry = {'path': path}
+            for step, (size, seconds) in steps.items():
+                if size:
+                    entry[step] = {'bytes': size, 'seconds': round(seconds, 6), 'mb_per_s': throughput(size, seconds)}
+            report['files'].append(entry)
+        if resource:
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+            report['peak_memory_mb'] = {
+                'main': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+                'workers': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1),
+            }
+        return report
+
+
+# Statistics of the run (--stats and --progress), None when disabled
+stats = None
+
+
+def lap(name):
+    if stats:
+        stats.lap(name)
+
+
+@contextlib.contextmanager
+def measured(name):
+    '''Add the duration of the block to the operation name of the statistics'''
+    if not stats:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add(stats.operations, name, time.perf_counter() - started)
+
+
+class Progress:
+    '''Live progress line of the processed files on stderr'''
+
+    def __init__(self, label, total, size, enabled=True):
+        self.label = label
+        self.total = total
+        self.size = size
+        self.enabled = enabled
+        self.done = 0
+        self.processed = 0
+        self.started = time.perf_counter()
+
+    def update(self, size):
+        self.done += 1
+        self.processed += size
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - self.started
+        rate = self.processed / 1e6 / elapsed if elapsed else 0
+        sys.stderr.write('\r%s: %d/%d file(s), %.1f/%.1f MB, %.1f MB/s ' % (self.label, self.done, self.total, self.processed / 1e6, self.size / 1e6, rate))
+        sys.stderr.flush()
+
+    def close(self):
+        if self.enabled and self.done:
+            sys.stderr.write('\n')
+            sys.stderr.flush()
+
+
+# State shared with the worker processes (scanner, replacer, chunk size)
+worker_state = {}
+
+
+def init_worker(state):
+    global stats
+    worker_state.update(state)
+    # A spawned worker (macOS, Windows) does not inherit the logging setup
+    # of the script, its progress and error lines would be lost
+    if state.get('logging'):
+        configure_logging()
+    # A worker gathers its own statistics, sent back with each result
+    stats = Stats() if state.get('stats') else None
+
+
+def stats_task(function, task):
+    return function(task), stats.drain()
+
+
+def run_tasks(function, tasks, jobs, state, pipeline=None):
+    '''Yield function(task) for every task, in order, using jobs worker processes
+
+    With a single job, pipeline (when given) runs all the tasks instead of
+    function, with the reads and the writes overlapped with the computation.
+    '''
+    if jobs <= 1:
+        worker_state.update(state)
+        if pipeline:
+            yield from pipeline(tasks)
+            return
+        for task in tasks:
+            yield function(task)
+        return
+    import concurrent.futures
+    executor = concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(dict(state, stats=bool(stats), logging=logging.getLogger().hasHandlers()),))
+    try:
+        if not stats:
+            yield from executor.map(function, tasks)
+            return
+        for result, worker_stats in executor.map(functools.partial(stats_task, function), tasks):
+            stats.merge(worker_stats)
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def read_errors():
+    '''The exceptions of a log that cannot be read: I/O errors, undecodable
+    text, truncated or corrupt compressed data'''
+    import zipfile
+    import zlib
+    return (OSError, UnicodeError, EOFError, zlib.error, zipfile.BadZipFile)
+
+
+def task_size(input_file, start, end):
+    return log_size(input_file) if start is None else end - start
+
+
+def collect_task(task):
+    input_file, start, end = task
+    started = time.perf_counter()
+    try:
+        if start is None:
+            result = collect_file(worker_state['scanner'], input_file, worker_state['chunk_size'], worker_state['mapped'])
+        else:
+            result = collect_range(worker_state['scanner'], input_file, start, end, worker_state['chunk_size'], mapped=input_file in worker_state['mapped_ranges'])
+        if stats:
+            stats.file(input_file, 'collect', task_size(input_file, start, end), time.perf_counter() - started)
+        return result
+    except read_errors() as e:
+        errlog('Error reading ' + input_file + ' : ' + str(e))
+        return None
+
+
+def anonymize_task(task):
+    input_file, output_file, progress, start, end, addresses = task
+    if progress:
+        stdlog(progress)
+    started = time.perf_counter()
+    try:
+        dbglog('    + anonymizing Veeam Server, ESXi, Domain, SMTPServer, vCenter, VeeamUser, Email, Location and IP Address')
+        anonymize_file(input_file, output_file, worker_state['replacer'], worker_state['chunk_size'], start, end, addresses)
+        if stats:
+            stats.file(input_file, 'anonymize', task_size(input_file, start, end), time.perf_counter() - started)
+    except read_errors():
+        return False
+    dbglog('- File ' + input_file + ' processed')
+    return True
+
+
+def verify_task(task):
+    output_file, start, end = task
+    started = time.perf_counter()
+    try:
+        result = verify_file(worker_state['replacer'], output_file, worker_state['chunk_size'], start, end)
+        if stats:
+            stats.file(output_file, 'verify', task_size(output_file, start, end), time.perf_counter() - started)
+        return result
+    except read_errors() as e:
+        errlog('Error reading ' + output_file + ' : ' + str(e))
+        return None
+
+
+# Chunks waiting in each queue of the pipeline, and chunk size of the
+# pipeline without --stream
+PIPELINE_DEPTH = 4
+PIPELINE_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def read_ahead(items, depth=PIPELINE_DEPTH):
+    '''Yield the items of an iterable produced by a reader thread
+
+    The reader runs at most depth items ahead of the consumer. Reads release
+    the GIL, the next chunks are read while the current one is processed.
+    '''
+    import queue
+    import threading
+    buffer = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # The consumer may stop early, the reader must not block forever
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((done, e))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class OutputWriter:
+    '''Writer thread of the pipeline, writes the outputs of the tasks in order
+
+    The compute stage submits, for every task, ('open', (output, encoding))
+    followed by the ('chunk', text) of the output and ('end', trailing byte),
+    or ('error', None) when the log could not be read. The success of every
+    task is put in results.
+    '''
+
+    def __init__(self, depth=PIPELINE_DEPTH):
+        import queue
+        import threading
+        self.items = queue.Queue(depth)
+        self.results = queue.Queue()
+        self.ended = True
+        self.closing = False
+        self.trailing = b''
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, payload=None):
+        self.items.put((kind, payload))
+
+    def chunks(self):
+        while True:
+            kind, payload = self.items.get()
+            if kind == 'chunk':
+                yield payload
+                continue
+            self.ended = True
+            if kind == 'end':
+                self.trailing = payload
+                return
+            self.closing = kind == 'close'
+            raise OSError('the log could not be read')
+
+    def run(self):
+        while not self.closing:
+            kind, payload = self.items.get()
+            if kind == 'close':
+                return
+            if kind == 'error':
+                self.results.put(False)
+                continue
+            try:
+                self.ended = False
+                output_file, encoding = payload
+                with atomic_output(output_file, encoding=encoding) as outfile:
+                    for data in self.chunks():
+                        outfile.write(data)
+                    write_trailing(outfile, self.trailing)
+                self.results.put(True)
+            except (OSError, UnicodeError):
+                # The rest of the output is dropped
+                while not self.ended:
+                    kind, _ = self.items.get()
+                    self.ended = kind in ('end', 'error', 'close')
+                    self.closing = kind == 'close'
+                self.results.put(False)
+
+    def close(self):
+        self.submit('close')
+        self.thread.join()
+
+
+def read_collect_tasks(tasks, chunk_size):
+    '''Reader stage of the collect pipeline: (task, kind, data) items of every log'''
+    for task in tasks:
+        input_file, start, end = task
+        if start is not None:
+            # Ranges are scanned past their end, by collect_task()
+            yield task, 'range', None
+            continue
+        try:
+            with open_log(input_file, start, end) as infile:
+                for chunk in iter_chunks(infile, chunk_size):
+                    yield task, 'chunk', chunk
+            yield task, 'end', None
+        except read_errors() as e:
+            yield task, 'error', e
+
+
+def collect_pipeline(tasks):
+    '''collect_task() of every task, the next chunks are read during the scan'''
+    items = read_ahead(read_collect_tasks(tasks, worker_state['chunk_size']))
+    for input_file, start, end in tasks:
+        if start is not None:
+            next(items)
+            yield collect_task((input_file, start, end))
+            continue
+        errors = []
+
+        def chunks():
+            for _, kind, data in items:
+                if kind != 'chunk':
+                    if kind == 'error':
+                        errors.append(data)
+                    return
+                yield data
+
+        started = time.perf_counter()
+        result = worker_state['scanner'].collect_chunks(chunks())
+        if errors:
+            errlog('Error reading ' + input_file + ' : ' + str(errors[0]))
+            yield None
+            continue
+        if stats:
+            stats.file(input_file, 'collect', task_size(input_file, start, end), time.perf_counter() - started)
+        yield result
+
+
+def read_anonymize_tasks(tasks, chunk_size):
+    '''Reader stage of the anonymize pipeline: (task, kind, data) items of every log
+
+    Every log goes through the substitutions, without the pass-through check
+    of anonymize_file(): its scan would hold the GIL in the reader thread,
+    against the compute stage, for about the cost of the substitutions.
+    '''
+    for task in tasks:
+        input_file, output_file, progress, start, end, _ = task
+        try:
+            with open_log(input_file, start, end) as infile:
+                yield task, 'open', infile.encoding
+                for chunk in iter_chunks(infile, chunk_size):
+                    yield task, 'chunk', chunk
+                yield task, 'end', trailing_byte(infile)
+        except read_errors():
+            yield task, 'error', None
+
+
+def anonymize_pipeline(tasks):
+    '''anonymize_task() of every task: a reader thread reads the next chunks
+    and a writer thread writes the previous ones during the substitutions'''
+    import queue
+    replacer = worker_state['replacer']
+    writer = OutputWriter()
+    current = None
+    try:
+        for task, kind, data in read_ahead(read_anonymize_tasks(tasks, worker_state['chunk_size'])):
+            input_file, output_file, progress, start, end, addresses = task
+            if task is not current:
+                current = task
+                started = time.perf_counter()
+                if progress:
+                    stdlog(progress)
+            if kind == 'chunk':
+                with measured('replace'):
+                    data = replacer.sub(data)
+                writer.submit(kind, mask_IPs(data, addresses))
+            else:
+                writer.submit(kind, (output_file, data) if kind == 'open' else data)
+            if kind == 'end' and stats:
+                stats.file(input_file, 'anonymize', task_size(input_file, start, end), time.perf_counter() - started)
+            while True:
+                try:
+                    yield writer.results.get_nowait()
+                except queue.Empty:
+                    break
+    finally:
+        writer.close()
+    while not writer.results.empty():
+        yield writer.results.get()
+
+
+class MappingStore:
+    '''SQLite store of the mappings and of the fingerprints of the processed logs'''
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS mappings (
+            kind TEXT NOT NULL,
+            original TEXT NOT NULL,
+            pseudonym TEXT NOT NULL,
+            PRIMARY KEY (kind, original)
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(self.schema)
+        self.fingerprints = {}
+
+    def load(self, kind):
+        '''Return the (original, pseudonym) list of a kind, in insertion order'''
+        cursor = self.connection.execute('SELECT original, pseudonym FROM mappings WHERE kind = ? ORDER BY rowid', (kind,))
+        return [tuple(row) for row in cursor]
+
+    def save(self, kind, mappings):
+        '''Add new mappings of a kind, a stored pseudonym is never changed'''
+        self.connection.executemany('INSERT OR IGNORE INTO mappings (kind, original, pseudonym) VALUES (?, ?, ?)',
+                                    [(kind, original, pseudonym) for original, pseudonym in mappings])
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def unchanged(self, path):
+        '''Tell if a log is the same as in the last run: same size and mtime, or same content'''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.connection.execute('SELECT size, mtime_ns, sha256 FROM files WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return True
+        sha256 = self.file_hash(path)
+        self.fingerprints[path] = (stat.st_size, stat.st_mtime_ns, sha256)
+        return bool(row) and row[0] == stat.st_size and row[2] == sha256
+
+    def known(self, path):
+        path = os.path.abspath(path)
+        return self.connection.execute('SELECT 1 FROM files WHERE path = ?', (path,)).fetchone() is not None
+
+    def save_fingerprints(self):
+        '''Remember the fingerprints computed by unchanged() for the next run'''
+        self.connection.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)',
+                                    [(path,) + fingerprint for path, fingerprint in self.fingerprints.items()])
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+# Subcommands of the distributed mode, each one runs a phase of a run on
+# its shard of the logs, through a shared directory
+PHASES = ('collect', 'merge', 'apply')
+
+
+def parse_shard(value):
+    '''Parse a --shard INDEX/COUNT value'''
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid shard: ' + value + ' (expected INDEX/COUNT like 0/4)')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError('invalid shard: ' + value + ' (INDEX must be between 0 and COUNT - 1)')
+    return index, count
+
+
+def collected_path(shared, shard):
+    index, count = shard
+    return os.path.join(shared, 'collect-' + str(index) + '-of-' + str(count) + '.json')
+
+
+def write_collected(shared, shard, records, patterns=None):
+    '''Write the entities collected by a shard: (order, path, found) of its logs
+
+    order is the position of the log in the whole run. A value already found
+    in a previous log of the shard is left out, adding it again to the
+    mapping would not change it, and only the first Veeam server is kept.
+    The IPv4 addresses belong to their log, they are all kept.
+    patterns is the content hash of the pattern pack used.
+    '''
+    seen = set()
+    server = False
+    files = []
+    for order, path, found in records:
+        compact = {}
+        for kind, values in found.items():
+            if kind == 'VeeamServer':
+                values = [] if server else values
+                server = server or bool(values)
+            elif kind != ADDRESSES:
+                values = [value for value in values if (kind, value) not in seen]
+                seen.update((kind, value) for value in values)
+            if values:
+                compact[kind] = values
+        if compact:
+            files.append([order, path, compact])
+    with atomic_output(collected_path(shared, shard)) as outfile:
+        json.dump({'shard': list(shard), 'patterns': patterns, 'files': files}, outfile, separators=(',', ':'))
+
+
+def read_collected(shared):
+    '''Return the (order, path, found) of the logs of all the shards, in run order'''
+    paths = glob.glob(os.path.join(shared, 'collect-*-of-*.json'))
+    if not paths:
+        raise ValueError('no collected shard in ' + shared)
+    shards = {}
+    packs = set()
+    for path in paths:
+        with open(path, 'r') as infile:
+            content = json.load(infile)
+        shards[tuple(content['shard'])] = content['files']
+        packs.add(content.get('patterns'))
+    if len(packs) > 1:
+        raise ValueError('the shards were collected with different pattern packs')
+    counts = {count for _, count in shards}
+    if len(counts) > 1:
+        raise ValueError('shards of different counts in ' + shared + ': ' + ', '.join(sorted(map(str, counts))))
+    count = counts.pop()
+    missing = [str(index) + '/' + str(count) for index in range(count) if (index, count) not in shards]
+    if missing:
+        raise ValueError('shard(s) not collected yet: ' + ', '.join(missing))
+    return sorted((tuple(record) for files in shards.values() for record in files), key=lambda record: record[0])
+
+
+class MappingFile:
+    '''JSON mapping shared by the merge and apply phases, with the load and
+    save interface of MappingStore'''
+
+    def __init__(self, path):
+        self.path = path
+        self.tables = {}
+        if os.path.exists(path):
+            with open(path, 'r') as infile:
+                self.tables = json.load(infile)
+
+    def load(self, kind):
+        return [tuple(item) for item in self.tables.get(kind, [])]
+
+    def save(self, kind, mappings):
+        table = self.tables.setdefault(kind, [])
+        known = {original for original, _ in table}
+        table.extend([original, pseudonym] for original, pseudonym in mappings if original not in known)
+
+    def commit(self):
+        with atomic_output(self.path) as outfile:
+            json.dump(self.tables, outfile, separators=(',', ':'))
+
+    def close(self):
+        pass
 
 
 def extract_domain(email):
@@ -156,57 +2118,647 @@ def extract_domain(email):
         return None
     
 
-def update_json_file(object_name, name_of_value, value, output_file):
-    # Try to read the existing JSON data if the file exists
-    try:
-        with open(output_file, 'r') as json_file:
-            existing_data = json.load(json_file)
-    except FileNotFoundError:
-        # pass  # If the file doesn't exist, ignore the error
-        existing_data = {}
-
-    # Update the existing data or create a new entry
-    if object_name in existing_data:
-        # Check if the name_of_value already exists in the list
-        found = False
-        for item in existing_data[object_name]:
-            if name_of_value in item:
-                item[name_of_value] = str(value)  # Update the existing value
-                found = True
-                break
-        if not found:
-            existing_data[object_name].append({name_of_value: str(value)})  # Add a new entry
-    else:
-        existing_data[object_name] = [{name_of_value: str(value)}]
+def write_dictionary(sections, output_file, dictionary_format='json'):
+    '''Write the dictionary of anonymized data in a single operation
 
-    # Write the updated data to the file
+    sections is a list of (section name, [(original, pseudonym), ...]). The
+    json and compact formats keep the {"section": [{"original": "pseudonym"}]}
+    layout, jsonl writes one {"section", "original", "pseudonym"} object per line.
+    '''
+    data = {}
+    for object_name, mappings in sections:
+        # One entry per original value, the last pseudonym wins
+        entries = {}
+        for name_of_value, value in mappings:
+            entries[name_of_value] = str(value)
+        if entries:
+            data[object_name] = entries
+    if not data:
+        return False
     with open(output_file, 'w') as json_file:
-        json.dump(existing_data, json_file, indent=4)
+        if dictionary_format == 'jsonl':
+            for object_name, entries in data.items():
+                for name_of_value, value in entries.items():
+                    json_file.write(json.dumps({"section": object_name, "original": name_of_value, "pseudonym": value}) + '\n')
+        else:
+            layout = {object_name: [{name_of_value: value} for name_of_value, value in entries.items()] for object_name, entries in data.items()}
+            if dictionary_format == 'compact':
+                json.dump(layout, json_file, separators=(',', ':'))
+            else:
+                json.dump(layout, json_file, indent=4)
+    return True
+
+
+class EntityMapping:
+    '''Registry of the entities found in the logs and of their pseudonyms
+
+    Every kind maps its original values to their pseudonyms in order of
+    discovery: a value is deduplicated and looked up in constant time, so
+    the mapping is built in linear time whatever the number of entities.
+    '''
+
+    kinds = ('VeeamUser', 'SMTPServer', 'vCenter', 'Domain', 'Location', 'Email', 'ESXi')
+
+    # Replacement precedence, a value of several kinds gets the pseudonym
+    # of the first one
+    precedence = (('ESXi hosts', 'ESXi'), ('Domain names', 'Domain'), ('SMTP Servers', 'SMTPServer'),
+                  ('vCenter Servers', 'vCenter'), ('VeeamUsers', 'VeeamUser'), ('Email address', 'Email'),
+                  ('vCenter Location', 'Location'))
+
+    def __init__(self, key=None):
+        # Secret key of the keyed pseudonymization, random pseudonyms when None
+        self.key = key
+        self.VeeamServer = False
+        self.RandomVeeamServer = None
+        self.entries = {kind: {} for kind in self.kinds}
+        # Domains already expanded to their parent domain
+        self.expanded = 0
+        # Derives the host labels of the FQDN without a key, the same in
+        # every worker and, with a store, in every run
+        self.salt = os.urandom(16).hex()
+
+    def pseudonym(self, value):
+        '''New pseudonym of a "Kind:original" value'''
+        return generate_random_string(value=value, key=self.key)
+
+    def register(self, kind, original, pseudonym):
+        '''Add an entity unless it is known, return its pseudonym
+
+        pseudonym is a function, only called for a new entity.
+        '''
+        table = self.entries[kind]
+        if original not in table:
+            table[original] = pseudonym()
+        return table[original]
+
+    def register_domain(self, fqdn):
+        '''Add the domain of a FQDN, return its host name'''
+        elements = get_element_from_fqdn(fqdn)
+        Domain = '.'.join(elements[1:])
+        self.register('Domain', Domain, lambda: self.pseudonym('Domain:' + Domain))
+        return elements[0]
+
+    def load(self, store):
+        '''Reuse the pseudonyms of the previous runs, tell if the Veeam server was stored'''
+        for kind in self.kinds:
+            for original, pseudonym in store.load(kind):
+                self.entries[kind].setdefault(original, pseudonym)
+        stored_server = store.load('VeeamServer')
+        if stored_server:
+            self.VeeamServer, self.RandomVeeamServer = stored_server[0]
+        for _, salt in store.load('Salt'):
+            self.salt = salt
+        return bool(stored_server)
+
+    def save(self, store):
+        for kind in self.kinds:
+            store.save(kind, self.entries[kind].items())
+        if self.VeeamServer:
+            store.save('VeeamServer', [(self.VeeamServer, self.RandomVeeamServer)])
+        store.save('Salt', [('host', self.salt)])
+
+    def size(self):
+        return sum(len(table) for table in self.entries.values())
+
+    def add(self, found):
+        '''Add the entities collected from a log'''
+        ### SMTP 
+        try:
+            for SMTPServer in found.get('SMTPServer'):
+                if SMTPServer in self.entries['SMTPServer']:
+                    continue
+                if is_fqdn(SMTPServer):
+                    self.register_domain(SMTPServer)
+                    RandomSMTP = self.pseudonym('SMTPServer:' + SMTPServer)
+                else:
+                    RandomSMTP = anonymized_IPv4(SMTPServer)
+                self.entries['SMTPServer'][SMTPServer] = RandomSMTP
+        except:
+            pass
 
+        if not self.VeeamServer:
+            try: 
+                self.VeeamServer = str(found.get('VeeamServer')[0])
+                self.RandomVeeamServer = self.pseudonym('VeeamServer:' + self.VeeamServer)
+            except:
+                pass
+
+        ### Veeam User 
+        try: 
+            for VeeamUser in found.get('VeeamUser'):
+                tmpUser = VeeamUser.split("\\")[1]
+                self.register('VeeamUser', tmpUser, lambda: self.pseudonym('VeeamUser:' + tmpUser))
+        except:
+            pass
+        
+        ### vCenter Server and ESXi Server, FQDN are registered by host name
+        for kind, key in (('vCenter', 'vCenter'), ('ESXi', 'ESXiServer')):
+            try:
+                for Server in found.get(key):
+                    if len(Server) == 0:
+                        continue
+                    if is_fqdn(Server):
+                        Server = self.register_domain(Server)
+                        self.register(kind, Server, lambda: self.pseudonym(kind + ':' + Server))
+                    else:
+                        self.register(kind, Server, lambda: anonymized_IPv4(Server))
+            except:
+                pass
+
+        ### Location 
+        try: 
+            for Location in found.get('Location'):
+                # All parts except the first and last ones
+                for part in Location.split('\\')[1:-1]:
+                    self.register('Location', part, lambda: self.pseudonym('Location:' + part))
+        except:
+           pass
+
+        ### email, the domain part is replaced by the pseudonym of the domain
+        try: 
+            for Email in found.get('Email'):
+                Domain = extract_domain(Email)
+                if not Domain or Email in self.entries['Email']:
+                    continue
+                RandomDomain = self.register('Domain', Domain, lambda: self.pseudonym('Domain:' + Domain))
+                self.entries['Email'][Email] = self.pseudonym('Email:' + Email) + '@' + RandomDomain
+        except:
+           pass
+
+    def expand_domains(self):
+        '''Add the parent domain of the subdomains, a.b.example.com gives example.com'''
+        Domains = list(self.entries['Domain'])
+        for Domain in Domains[self.expanded:]:
+            parts = Domain.split('.')
+            if len(parts) > 2:
+                main_domain = '.'.join(parts[-2:])
+                self.register('Domain', main_domain, lambda: self.pseudonym('Domain:' + main_domain))
+        # The parent domains have two labels, they are not expanded again
+        self.expanded = len(self.entries['Domain'])
+
+    def sections(self):
+        '''Return the (section name, [(original, pseudonym), ...]) of the dictionary'''
+        entries = self.entries
+        vCenters = entries['vCenter']
+        return [("VeeamUsers", sorted(entries['VeeamUser'].items())),
+                ("SMTP Servers", list(entries['SMTPServer'].items())),
+                ("vCenter Servers", sorted(vCenters.items())),
+                ("vCenter Location", sorted(entries['Location'].items())),
+                ("Email address", list(entries['Email'].items())),
+                # A host known as a vCenter is not an ESXi host
+                ("ESXi hosts", sorted(item for item in entries['ESXi'].items() if item[0] not in vCenters)),
+                ("Domain names", list(entries['Domain'].items()))]
+
+    def replacements(self):
+        '''Return the (original, pseudonym, category) of every value, in precedence order'''
+        result = []
+        if self.VeeamServer:
+            result.append((self.VeeamServer, self.RandomVeeamServer, 'Veeam Server'))
+        vCenters = self.entries['vCenter']
+        for category, kind in self.precedence:
+            for original, pseudonym in self.entries[kind].items():
+                if kind == 'ESXi' and original in vCenters:
+                    continue
+                result.append((original, pseudonym, category))
+        return result
+
+    def replacer(self):
+        '''Build the replacement engine'''
+        replacements = self.replacements()
+        return Replacer([(original, pseudonym) for original, pseudonym, _ in replacements],
+                        [category for _, _, category in replacements],
+                        self.entries['Domain'], self.key or self.salt.encode('ascii'))
+
+
+class Anonymizer:
+    '''Anonymize Veeam logs in memory, the entry point of the library use
+
+    Every text given to learn() or anonymize() extends the mapping, a value
+    keeps the same pseudonym in all of them:
+
+        anonymizer = Anonymizer()
+        text = anonymizer.anonymize(text)
+        sections = anonymizer.dictionary()
+    '''
+
+    def __init__(self, patterns=None, key=None, mapping=None):
+        '''patterns is an EntityScanner, the name or the path of a pattern pack
+        or a list of them (default: the patterns.json of the script), key the pseudonymization key (as
+        --key-file, kept by the mapping) and mapping an EntityMapping to extend'''
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        self.scanner = patterns if isinstance(patterns, EntityScanner) else load_patterns(patterns)
+        self.mapping = mapping if mapping is not None else EntityMapping(key)
+        if key is not None:
+            self.mapping.key = key
+        self.replacer = None
+        self.known = None
+
+    @staticmethod
+    def batches(lines, batch_size=1024 * 1024):
+        '''Join the lines of a file object or iterable in batches of about batch_size characters'''
+        batch = []
+        size = 0
+        for line in lines:
+            batch.append(line)
+            size += len(line)
+            if size >= batch_size:
+                yield batch[0][:0].join(batch)
+                batch = []
+                size = 0
+        if batch:
+            yield batch[0][:0].join(batch)
+
+    def learn(self, content):
+        '''Add the entities of a str, bytes, file object or iterable of lines to the mapping
+
+        Return True when the mapping changed.
+        '''
+        if isinstance(content, bytes):
+            content = decode_value(content)
+        if isinstance(content, str):
+            self.mapping.add(self.scanner.collect(content))
+        else:
+            for batch in self.batches(content):
+                self.learn(batch)
+        self.mapping.expand_domains()
+        known = (self.mapping.size(), self.mapping.VeeamServer)
+        if known == self.known:
+            return False
+        self.known = known
+        self.replacer = None
+        return True
+
+    def sub(self, text, addresses=None):
+        '''Anonymize a str with the current mapping, without learning from it
+
+        The "x.x.x.x]" copies of the IPv4 addresses of text are masked.
+        addresses is a set of the addresses of the previous parts of the same
+        log, they are masked too and the set is extended with the ones of text.
+        '''
+        if self.replacer is None:
+            self.replacer = self.mapping.replacer()
+        if addresses is None:
+            addresses = set()
+        addresses.update(find_IPv4(text))
+        return mask_IPs(self.replacer.sub(text), addresses)
+
+    def anonymize(self, content, learn=True, addresses=None):
+        '''Anonymize a str or bytes, or the lines of a file object or iterable
+
+        str and bytes give the same type back, bytes are UTF-8 (invalid bytes
+        are kept as they are). A file object or an iterable gives a generator
+        of anonymized batches of lines. Unless learn is False, the entities of
+        the content (of each batch) are added to the mapping before it is
+        anonymized. addresses is the set of the IPv4 addresses of the log,
+        as for sub(), the batches of a file object share one.
+        '''
+        if isinstance(content, bytes):
+            return self.anonymize(decode_value(content), learn, addresses).encode('utf-8', 'surrogateescape')
+        if isinstance(content, str):
+            if learn:
+                self.learn(content)
+            return self.sub(content, addresses)
+        if addresses is None:
+            addresses = set()
+        return (self.anonymize(batch, learn, addresses) for batch in self.batches(content))
+
+    def anonymize_stream(self, infile, outfile, chunk_size=1024 * 1024):
+        '''Anonymize a binary stream to a binary stream as the data comes in
+
+        The complete lines available are anonymized and written at once, a
+        pipe fed line by line gives its anonymized lines without waiting. The
+        "x.x.x.x]" copies of an IPv4 address are masked once the address was
+        read in the stream.
+        '''
+        read = getattr(infile, 'read1', infile.read)
+        pending = b''
+        addresses = set()
+        while True:
+            data = read(chunk_size)
+            if not data:
+                break
+            data = pending + data
+            cut = data.rfind(b'\n') + 1
+            if not cut and len(data) < chunk_size:
+                pending = data
+                continue
+            cut = cut or len(data)
+            outfile.write(self.anonymize(data[:cut], addresses=addresses))
+            outfile.flush()
+            pending = data[cut:]
+        if pending:
+            outfile.write(self.anonymize(pending, addresses=addresses))
+            outfile.flush()
+
+    def dictionary(self):
+        '''Return the (section name, [(original, pseudonym), ...]) of the mapping'''
+        return self.mapping.sections()
+
+
+# Bytes read from the followed logs on each poll of --watch, a log with more
+# new bytes is read again without waiting
+WATCH_READ_SIZE = 16 * 1024 * 1024
+
+
+def read_new_lines(log_file_path, position, max_line=65536, max_read=WATCH_READ_SIZE):
+    '''Return the (position, restart, complete lines, more) appended to a log since position
+
+    position is the (identity, offset) of the last read, None for a log not
+    read yet. The identity is the device and inode of the log: a log replaced
+    by another file or truncated (rotated) is read again from its start and
+    restart is True. At most max_read bytes are read, more is True when the
+    log holds other bytes after them. An unfinished line waits for the next
+    read unless it is longer than max_line.
+    '''
+    with open(log_file_path, 'rb') as log_file:
+        stat = os.fstat(log_file.fileno())
+        identity = (stat.st_dev, stat.st_ino)
+        offset = 0
+        restart = True
+        if position is not None and position[0] == identity and stat.st_size >= position[1]:
+            offset = position[1]
+            restart = False
+        log_file.seek(offset)
+        data = log_file.read(min(max(max_read, max_line + 1), stat.st_size - offset))
+    more = offset + len(data) < stat.st_size
+    end = data.rfind(b'\n') + 1
+    if not end and len(data) > max_line:
+        end = len(data)
+    return (identity, offset + end), restart, decode_value(data[:end]), more
+
+
+def move_aside(output_file):
+    '''Rename an output to the first free output.N name, so it is not overwritten'''
+    number = 1
+    while os.path.exists(output_file + '.' + str(number)):
+        number += 1
+    os.replace(output_file, output_file + '.' + str(number))
+    return output_file + '.' + str(number)
+
+
+def follow_logs(list_logs, output_path, anonymizer, interval=0.5, store=None):
+    '''Anonymize the logs, then the lines appended to them, until interrupted
+
+    list_logs() returns the logs to follow, it is called on every poll so new
+    logs are picked up. The first read of a log writes its output again, the
+    next ones append the anonymized new lines to it. The output of a rotated
+    log is moved aside first, to output.N, as the rotated log may not be
+    followed under its new name. The logs are read by chunks, at most
+    WATCH_READ_SIZE bytes on each poll, the entities of a log read in several
+    polls are learned from all of it first. The mapping is extended with the
+    entities of the new lines, lines written before an entity was first found
+    are not rewritten. The IPv4 addresses are kept for each log, from its
+    last (re)start.
+    '''
+    positions = {}
+    addresses = {}
+    while True:
+        started = time.monotonic()
+        updates = []
+        budget = WATCH_READ_SIZE
+        pending = False
+        learned = False
+        for log_file_path in list_logs():
+            if budget <= 0:
+                pending = True
+                continue
+            previous = positions.get(log_file_path)
+            try:
+                position, restart, lines, more = read_new_lines(log_file_path, previous, max_read=budget)
+                if restart:
+                    addresses[log_file_path] = set()
+                if restart and more:
+                    # Read in several polls: the entities of the whole log are
+                    # known before its first lines are written
+                    with open(log_file_path, 'rb') as log_file:
+                        for batch in anonymizer.batches(log_file):
+                            batch = decode_value(batch)
+                            learned = anonymizer.learn(batch) or learned
+                            addresses[log_file_path].update(find_IPv4(batch))
+            except OSError as e:
+                # Removed while rotated, read again from its start when it is back
+                dbglog('Cannot read ' + log_file_path + ' : ' + str(e))
+                continue
+            rotated = restart and previous is not None
+            positions[log_file_path] = position
+            budget -= position[1] - (0 if restart else previous[1])
+            pending = pending or more
+            if lines or restart:
+                updates.append((log_file_path, restart, rotated, lines))
+
+        # Entities of all the new lines are known before any of them is written
+        for _, _, _, lines in updates:
+            learned = anonymizer.learn(lines) or learned
+        if learned and store:
+            anonymizer.mapping.save(store)
+            store.commit()
+
+        for log_file_path, restart, rotated, lines in updates:
+            output_file = output_path(log_file_path)
+            if restart:
+                dbglog('Following ' + log_file_path)
+            try:
+                if rotated and os.path.exists(output_file):
+                    dbglog('Rotated ' + log_file_path + ', its output is moved to ' + move_aside(output_file))
+                os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+                with open(output_file, 'w' if restart else 'a', encoding='utf-8', errors='surrogateescape', newline='') as outfile:
+                    outfile.write(anonymizer.sub(lines, addresses[log_file_path]))
+            except OSError as e:
+                errlog('Error writing ' + output_file + ' : ' + str(e))
+
+        if not pending:
+            time.sleep(max(0, interval - (time.monotonic() - started)))
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Anonymize your Veeam Backup & Replication logs.")
-    parser.add_argument("-i", "--input", dest="input_file", help="Input log file")
+    parser = argparse.ArgumentParser(description="Anonymize your Veeam Backup & Replication logs.",
+                                     epilog="Distributed mode: VeeamLogAnonymizer.py {collect,merge,apply} --shared DIR [options]. "
+                                            "collect the entities of a shard of the logs, merge them in one mapping, then apply it to each shard.")
+    parser.add_argument("input", nargs="?", help="Input log file, - to anonymize the standard input to the standard output (filter mode)")
+    parser.add_argument("-i", "--input", dest="input_file", help="Input log file, - for the standard input")
     parser.add_argument("-d", "--directory", dest="input_directory", help="Input directory containing log files")
-    parser.add_argument("-o", "--output", dest="output_directory", required=True, help="Output directory for processed log files")
+    parser.add_argument("-o", "--output", dest="output_directory", help="Output directory for processed log files (required unless the input is the standard input)")
     parser.add_argument("-f", "--force", action="store_true", help="Force overwrite if output files exist or force the creation of output directory if not exists")
     parser.add_argument("-m","--mapping", action="store_true", help="Display the mapping table of anonymized data")
     parser.add_argument("-v", "--verbose", action="store_true", help="Display processing files and other information")
     parser.add_argument("-D", "--dictionary", action="store_true", help="output a JSON file with the dictionary of anonymized data")
+    parser.add_argument("--dictionary-format", dest="dictionary_format", choices=["json", "compact", "jsonl"], default="json", help="Format of the -D dictionary: indented JSON, compact JSON or JSON Lines (default: json)")
+    parser.add_argument("-k", "--key-file", dest="key_file", help="File holding a secret key: pseudonyms are derived from it and are the same on every run (default: VEEAM_ANONYMIZER_KEY environment variable)")
+    parser.add_argument("-S", "--store", nargs="?", const=True, default=None, metavar="PATH", help="Keep the mappings and the fingerprints of the processed files in a SQLite store (default: VeeamAnonymizer.db in the output directory) and only process the new or changed files on the next runs")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="Number of worker processes, 0 for one per CPU (default: 1)")
+    parser.add_argument("--split-size", dest="split_size", type=int, default=256, metavar="MB", help="With several jobs, split the files larger than this size in MB between the workers (default: 256)")
+    parser.add_argument("--stream", action="store_true", help="Process the log files by chunks to keep the memory usage bounded")
+    parser.add_argument("--max-memory", dest="max_memory", type=int, default=64, metavar="MB", help="Memory ceiling in MB for each file processed with --stream (default: 64)")
+    parser.add_argument("-z", "--compress", action="store_true", help="Write the anonymized gzip logs gzip compressed and the logs of zip archives in zip archives with the same layout, instead of decompressed files")
+    parser.add_argument("--mmap", action="store_true", help="Collect the entities with bytes patterns over the memory-mapped logs instead of decoding them")
+    parser.add_argument("--stats", metavar="FILE", help="Write a JSON report of the run: time of each phase, per-pattern matches and regex time, replacements, per-file throughput and peak memory")
+    parser.add_argument("--progress", action="store_true", help="Display a live progress line of the collected and anonymized files on stderr")
+    parser.add_argument("--pipeline", action="store_true", help="With a single job, read the next chunks of the logs and write the anonymized ones in background threads while the current chunk is processed")
+    parser.add_argument("--watch", action="store_true", help="Keep following the logs: the lines appended to them, the new logs and the rotated logs are anonymized as they are written, until interrupted with Ctrl+C")
+    parser.add_argument("--since", type=parse_time, metavar="TIME", help="Only keep the lines logged at or after this time: YYYY-MM-DD [HH:MM[:SS]], DD.MM.YYYY [HH:MM[:SS]] or a duration before now like 6h, 30m or 2d")
+    parser.add_argument("--until", type=parse_time, metavar="TIME", help="Only keep the lines logged at or before this time, same formats as --since")
+    parser.add_argument("--verify", action="store_true", help="Once anonymized, scan the output files for any original value of the mapping and report each leak with its file, offset and type")
+    parser.add_argument("--shared", metavar="DIR", help="With the collect, merge and apply subcommands, directory shared by all the shards: collected entities and mapping")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1), metavar="INDEX/COUNT", help="With collect and apply, only process the logs of this shard, every COUNT-th log starting at INDEX (default: 0/1, all the logs)")
+    parser.add_argument("--interval", type=float, default=0.5, metavar="SECONDS", help="Delay between two reads of the followed logs with --watch (default: 0.5)")
+    parser.add_argument("-P", "--patterns", action="append", metavar="PACK", help="Pattern pack to use: default (patterns.json), the name of a pack of the patterns directory or a file. Repeat it to combine packs, a later pack replaces the pattern of a kind")
+
+    # The distributed mode subcommands come first, the input is positional
+    phase = None
+    argv = sys.argv[1:]
+    if argv and argv[0] in PHASES:
+        phase = argv.pop(0)
+    args = parser.parse_args(argv)
+    if args.input and not args.input_file:
+        args.input_file = args.input
+    start_time = time.time()
+
+    global stats
+    if args.stats:
+        stats = Stats()
 
-    if not os.path.exists('patterns.json'):
+    if not args.patterns and not os.path.exists(PATTERNS_FILE):
         errlog("Error: patterns.json not found.")
         sys.exit(1)
 
-    args = parser.parse_args()
+    try:
+        scanner = load_patterns(args.patterns)
+        if args.mmap:
+            scanner.compile_mapped()
+    except OSError as e:
+        errlog('Error: cannot read the pattern pack (' + str(e) + ')')
+        sys.exit(1)
+    except (ValueError, re.error) as e:
+        errlog('Error: invalid pattern pack (' + str(e) + ')')
+        sys.exit(1)
+    if args.verbose:
+        stdlog('Pattern pack ' + '+'.join(args.patterns or ['default']) + ' (sha256 ' + scanner.digest[:12] + ')')
+        for warning in scanner.warnings:
+            stdlog('  warning: ' + warning)
 
     input_files=[]
 
     verbose = args.verbose 
 
+    try:
+        key = read_pseudonym_key(args.key_file)
+    except OSError as e:
+        errlog('Error: cannot read the key file (' + str(e) + ')')
+        sys.exit(1)
+    if key:
+        stdlog('Keyed pseudonymization enabled')
+
+    output_directory = args.output_directory
+
+    if phase:
+        if not args.shared:
+            errlog('Error: the ' + phase + ' subcommand needs the shared directory (--shared)')
+            sys.exit(1)
+        if args.input_file == '-' or args.watch or args.store:
+            errlog('Error: the ' + phase + ' subcommand cannot be used with the standard input, --watch or -S')
+            sys.exit(1)
+        os.makedirs(args.shared, exist_ok=True)
+        if phase != 'apply':
+            # Nothing is anonymized, a dictionary goes to the shared directory
+            output_directory = output_directory or args.shared
+    elif args.shared or args.shard != (0, 1):
+        errlog('Error: --shared and --shard are options of the collect, merge and apply subcommands')
+        sys.exit(1)
+
+    def dump_dictionary(sections):
+        if not os.path.exists(output_directory) and args.force:
+            os.makedirs(output_directory)  
+        current_datetime = datetime.datetime.now()
+        formatted_datetime = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+        extension = 'jsonl' if args.dictionary_format == 'jsonl' else 'json'
+        filename = f"VeeamAnonymizer-{formatted_datetime}.{extension}"
+        outputdictfile  = output_directory + "/" + filename
+        write_dictionary(sections, outputdictfile, args.dictionary_format)
+        stdlog('Json file created')
+
+    if args.verify and (args.input_file == '-' or args.watch):
+        errlog('Error: --verify scans the output files, it cannot be used with the standard input or --watch')
+        sys.exit(1)
+
+    windowed = args.since is not None or args.until is not None
+    if windowed and (args.input_file == '-' or args.watch or args.store):
+        errlog('Error: --since and --until select the lines of the log files, they cannot be used with the standard input, --watch or -S')
+        sys.exit(1)
+
+    if phase == 'merge':
+        # One mapping for all the shards, built as a single run would
+        mapping = EntityMapping(key)
+        try:
+            records = read_collected(args.shared)
+        except (OSError, ValueError, KeyError) as e:
+            errlog('Error: cannot merge the collected entities (' + str(e) + ')')
+            sys.exit(1)
+        for _, _, found in records:
+            mapping.add(found)
+        mapping.expand_domains()
+        mapping_file = MappingFile(os.path.join(args.shared, 'mapping.json'))
+        mapping.save(mapping_file)
+        mapping_file.commit()
+        stdlog('Mapping of ' + str(mapping.size()) + ' value(s) merged')
+        if args.dictionary:
+            dump_dictionary(mapping.sections())
+        return
+
+    if args.input_file == '-':
+        # Unix filter, the standard output only holds the anonymized log
+        if args.dictionary and not output_directory:
+            errlog('Error: -D needs the output directory of the dictionary (-o)')
+            sys.exit(1)
+        anonymizer = Anonymizer(scanner)
+        anonymizer.anonymize_stream(sys.stdin.buffer, sys.stdout.buffer)
+        if args.dictionary:
+            dump_dictionary(anonymizer.dictionary())
+        return
+
+    if not output_directory:
+        errlog('Error: You must specify the output directory with -o.')
+        sys.exit(1)
+
+    jobs = args.jobs or os.cpu_count() or 1
+    if jobs < 0:
+        errlog('Error: --jobs must be a positive number')
+        sys.exit(1)
+
+    if args.watch and args.interval <= 0:
+        errlog('Error: --interval must be a positive number of seconds')
+        sys.exit(1)
+
+    if args.split_size < 1:
+        errlog('Error: --split-size must be at least 1 MB')
+        sys.exit(1)
+    split_size = args.split_size * 1024 * 1024 if jobs > 1 else 0
+
+    # Input, its overlap, the substituted copy and the encoded output live
+    # together, and the pipeline queues hold their chunks too
+    chunk_size = None
+    pipelined = args.pipeline and jobs <= 1
+    if args.stream:
+        if args.max_memory < 1:
+            errlog('Error: --max-memory must be at least 1 MB')
+            sys.exit(1)
+        chunk_size = args.max_memory * 1024 * 1024 // (4 + 2 * PIPELINE_DEPTH if pipelined else 4)
+    elif pipelined:
+        chunk_size = PIPELINE_CHUNK_SIZE
+
+    def add_input(path):
+        # The logs of a zip archive are read from it, without extracting them
+        if path.lower().endswith('.zip'):
+            import zipfile
+            try:
+                input_files.extend(list_archive(path))
+            except (OSError, zipfile.BadZipFile) as e:
+                errlog('Error reading ' + path + ' : ' + str(e))
+        else:
+            input_files.append(path)
+
     if args.input_file:
-        input_files.append(args.input_file)
+        add_input(args.input_file)
     elif args.input_directory:
         input_directory = args.input_directory
         if not os.path.isdir(input_directory):
@@ -215,17 +2767,17 @@ def main():
         if not os.path.exists(input_directory):
             errlog('Error: Input directory ' + input_directory + ' does not exist.')
             sys.exit(1)
-         # Use os.walk to find all .log files recursively
-        for root, _, files in os.walk(input_directory):
-            for filename in files:
-                if filename.endswith(".log"):
-                    input_files.append(os.path.join(root, filename))
+         # Use os.walk to find all .log files, gzip logs and zip archives recursively,
+        # in the same order on every run and every host, for the shards
+        for root, dirs, files in os.walk(input_directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if is_log_name(filename) or filename.lower().endswith(".zip"):
+                    add_input(os.path.join(root, filename))
 
     else:
         errlog('Error: You must specify either -i or -d.')
         sys.exit(1)
-        
-    output_directory = args.output_directory
 
     # Specify the pattern to match files with a similar format
     filename_pattern = 'VeeamAnonymizer-*.json'
@@ -239,243 +2791,274 @@ def main():
     if matching_files:
         stdlog("ATTENTION : An old VeeamAnonymizer dictionnary exists in the output directory")
 
-    # Init list 
-    VeeamServer = False
-    
-    VeeamUserList = []
-    User_set = set()
-    
-    SMTPServerList = []
-    SMTPServer_set = set()
-    
-    vCenterList = []
-    vCenter_set = set()
-
-    DomainList = []
-    Domain_set = set()
+    def output_path(input_file):
+        archive, member = archive_member(input_file)
+        if args.input_file:
+            path = os.path.join(output_directory, os.path.basename(archive))
+        else:
+            path = archive.replace(args.input_directory,args.output_directory,1)
+        if member is not None:
+            if args.compress:
+                return path + '!' + member
+            # Extracted in a directory named after the archive, never outside of it
+            path = os.path.join(path[:-4], *[part for part in member.split('/') if part not in ('', '.', '..')])
+        if input_file.endswith('.gz') and not args.compress:
+            path = path[:-3]
+        return path
+
+    # Position of each log in the whole run, the shards are merged in this order
+    order = {input_file: index for index, input_file in enumerate(input_files)}
+    if phase:
+        # The logs of a zip archive are in the same shard, they are written to the same archive
+        index, count = args.shard
+        sources = list(dict.fromkeys(archive_member(input_file)[0] for input_file in input_files))
+        shard = set(sources[index::count])
+        input_files = [input_file for input_file in input_files if archive_member(input_file)[0] in shard]
+
+    # Byte range of the lines of each log in the time window
+    windows = {}
+    if windowed:
+        selected = []
+        for input_file in input_files:
+            try:
+                if log_encoding(input_file) != 'utf-8':
+                    # Its timestamps are not searched in the bytes, it is kept whole
+                    dbglog('- ' + input_file + ' is UTF-16, processed whole')
+                    selected.append(input_file)
+                    continue
+                window = time_window(input_file, args.since, args.until)
+            except read_errors() as e:
+                errlog('Error reading ' + input_file + ' : ' + str(e))
+                continue
+            if window is None:
+                dbglog('- ' + input_file + ' has no line in the time window')
+                continue
+            windows[input_file] = window
+            selected.append(input_file)
+        stdlog(str(len(input_files) - len(selected)) + ' file(s) outside the time window skipped')
+        input_files = selected
+
+    mapping = EntityMapping(key)
 
-    LocationList = []
-    Location_set = set() 
+    nbfile = 0
 
-    EmailList = []
-    Email_set = set()
-    
-    ESXiList = []
-    ESXi_set = set()
+    store = None
+    collect_files = input_files
+    if args.store:
+        if not os.path.exists(output_directory) and args.force:
+            os.makedirs(output_directory)
+        store_path = os.path.join(output_directory, 'VeeamAnonymizer.db') if args.store is True else args.store
+        import sqlite3
+        try:
+            store = MappingStore(store_path)
+        except sqlite3.Error as e:
+            errlog('Error: cannot open the mapping store ' + store_path + ' (' + str(e) + ')')
+            sys.exit(1)
+        # Reuse the pseudonyms of the previous runs
+        stored_server = mapping.load(store)
+        stored = mapping.size()
+        collect_files = []
+        for input_file in input_files:
+            try:
+                if store.unchanged(input_file) and os.path.exists(output_path(input_file)):
+                    continue
+            except OSError:
+                pass
+            collect_files.append(input_file)
+        stdlog(str(len(input_files) - len(collect_files)) + ' file(s) unchanged since the last run')
 
-    nbfile = 0
+    lap('discovery')
 
     stdlog('Collecting information')
-    for input_file in input_files:
-        nbfile += 1
-        filename = os.path.basename(input_file)
-        
-        dbglog('*** ' +  filename)
-        
-        output_file = os.path.join(output_directory, filename)
-        
+    for input_file in collect_files if phase != 'collect' else []:
+        output_file = os.path.join(output_directory, os.path.basename(input_file))
+        if store and store.known(input_file):
+            continue
         if os.path.exists(output_file) and not args.force:
             errlog(f'Error: Output file {output_file} already exists. Use -f or --force to overwrite.')
             sys.exit(1)
-        
-        ### SMTP 
-        SMTPServers = find_pattern('SMTPServer',input_file)
+
+    if phase == 'apply':
+        # The entities were collected by the collect phase and merged in the mapping
+        mapping_path = os.path.join(args.shared, 'mapping.json')
+        if not os.path.exists(mapping_path):
+            errlog('Error: ' + mapping_path + ' not found, run the merge subcommand first')
+            sys.exit(1)
         try:
-            for SMTPServer in SMTPServers:
-                if SMTPServer in SMTPServer_set:
-                    continue
-                SMTPServer_set.add(SMTPServer)
-                if is_fqdn(SMTPServer):
-                    RandomSMTP = str(generate_random_string())
-                    Domain = '.'.join(get_element_from_fqdn(SMTPServer)[1:])
-                    if Domain not in Domain_set:
-                        Domain_set.add(Domain)
-                        element = (Domain, RandomDomain)
-                        DomainList.append(element)
-                else:
-                    RandomSMTP = anonymized_IPv4(SMTPServer)
-                element = (SMTPServer, RandomSMTP)
-                SMTPServerList.append(element)
-        except:
-            pass
+            mapping.load(MappingFile(mapping_path))
+        except (OSError, ValueError) as e:
+            errlog('Error: cannot read the mapping ' + mapping_path + ' (' + str(e) + ')')
+            sys.exit(1)
+        collect_files = []
 
-        if not VeeamServer:
-            try: 
-                VeeamServer = str(find_pattern('VeeamServer',input_file)[0])
-                RandomVeeamServer = str(generate_random_string())
-            except:
-                pass
+    if args.watch:
+        if args.input_file and (is_compressed(args.input_file) or args.input_file.lower().endswith('.zip')):
+            errlog('Error: --watch only follows plain .log files')
+            sys.exit(1)
 
-        ### Veeam User 
-        VeeamUsers = find_pattern('VeeamUser',input_file)
-        try: 
-            for VeeamUser in VeeamUsers:
-                tmpUser = VeeamUser.split("\\")[1]
-                tmpRandom = str(generate_random_string())
-                if tmpUser in User_set:
-                    continue
-                User_set.add(tmpUser)  # Add the unique tmpUser value to the set
-                element = (tmpUser, tmpRandom)
-                VeeamUserList.append(element)
-        except:
-            pass
-        
-        ### vCenter Server 
-        vCenters = find_pattern('vCenter',input_file)
-        try: 
-            for vCenter in vCenters:
-                if len(vCenter) == 0:
-                    continue 
-                if is_fqdn(vCenter):
-                    RandomDomain = str(generate_random_string())
-                    Domain = '.'.join(get_element_from_fqdn(vCenter)[1:])
-                    if Domain not in Domain_set:
-                        Domain_set.add(Domain)
-                        element = (Domain, RandomDomain)
-                        DomainList.append(element)
-                    vCenter = get_element_from_fqdn(vCenter)[0]
-                    RandomvCenter = str(generate_random_string())
-                else:
-                    RandomvCenter= anonymized_IPv4(vCenter)
-                if vCenter in vCenter_set:
-                    continue
-                vCenter_set.add(vCenter)  # Add the unique tmpUser value to the set
-                element = (vCenter, RandomvCenter)
-                vCenterList.append(element)              
-        except:
+        encodings = {}
+
+        def followed(log_file_path):
+            # The new lines are cut at UTF-8 line ends, UTF-16 logs are not followed
+            if log_file_path not in encodings:
+                try:
+                    encodings[log_file_path] = log_encoding(log_file_path)
+                except OSError:
+                    return True
+            return encodings[log_file_path] == 'utf-8'
+
+        def list_logs():
+            # gzip logs and zip archives are not written to, only plain logs are followed
+            if args.input_file:
+                return list(filter(followed, [args.input_file]))
+            return sorted(os.path.join(root, filename) for root, _, files in os.walk(args.input_directory)
+                          for filename in files if is_log_name(filename) and not is_compressed(filename)
+                          and followed(os.path.join(root, filename)))
+
+        stdlog('Following ' + str(len(list_logs())) + ' file(s), press Ctrl+C to stop')
+        try:
+            follow_logs(list_logs, output_path, Anonymizer(scanner, mapping=mapping), args.interval, store)
+        except KeyboardInterrupt:
+            stdlog('Stopped following the logs')
+        if store:
+            mapping.save(store)
+            store.commit()
+            store.close()
+        if args.dictionary:
+            dump_dictionary(mapping.sections())
+        return
+
+    def ranges_of(input_file):
+        # Files larger than --split-size are cut in line aligned ranges shared between the workers,
+        # only the time window of a file is processed
+        window = windows.get(input_file)
+        try:
+            if split_size and not is_compressed(input_file) and log_encoding(input_file) == 'utf-8':
+                start, end = window or (0, os.path.getsize(input_file))
+                if end - start > split_size:
+                    return split_file(input_file, split_size, start, end)
+        except OSError:
             pass
+        return [window] if window else None
+
+    layout = []
+    tasks = []
+    # The logs scanned in ranges with --mmap, decided once for all the ranges of a log
+    mapped_ranges = set()
+    for input_file in collect_files:
+        ranges = ranges_of(input_file)
+        layout.append((input_file, ranges))
+        if ranges:
+            tasks.extend((input_file, start, end) for start, end in ranges)
+            try:
+                if args.mmap and mappable(input_file):
+                    mapped_ranges.add(input_file)
+            except OSError:
+                pass
+        else:
+            tasks.append((input_file, None, None))
+    results = run_tasks(collect_task, tasks, jobs, {'scanner': scanner, 'chunk_size': chunk_size, 'mapped': args.mmap, 'mapped_ranges': mapped_ranges},
+                        collect_pipeline if args.pipeline and not args.mmap else None)
 
-
-        ### Location 
-        Locations = find_pattern('Location', input_file)
-        try: 
-            for Location in Locations:
-                split_data = Location.split('\\')
-                # Print all parts except the first and last ones
-                for part in split_data[1:-1]:
-                    RandomLocation = str(generate_random_string())
-                    if part not in Location_set:
-                        Location_set.add(part)
-                        element = (part, RandomLocation)
-                        LocationList.append(element)                  
-        except:
-           pass
-
-        #ESXi Server 
-        ESXiServers = find_pattern('ESXiServer',input_file)
+    def file_size(input_file):
         try:
-            for ESXi in ESXiServers:
-                if is_fqdn(ESXi):
-                    RandomDomain = str(generate_random_string())
-                    Domain = '.'.join(get_element_from_fqdn(ESXi)[1:])
-                    if Domain not in Domain_set:
-                        Domain_set.add(Domain)
-                        element = (Domain, RandomDomain)
-                        DomainList.append(element)
-                    ESXi = get_element_from_fqdn(ESXi)[0]
-                    RandomESXi = str(generate_random_string())
-                else:
-                    RandomESXi = anonymized_IPv4(ESXi)
-                if ESXi in ESXi_set:
-                    continue
-                ESXi_set.add(ESXi)
-                element = (ESXi, RandomESXi)
-                ESXiList.append(element) 
-        except:
-            pass
+            return log_size(input_file)
+        except OSError:
+            return 0
+
+    progress_line = Progress('Collecting', len(collect_files), sum(map(file_size, collect_files)), args.progress)
+
+    def collected():
+        # Files are collected in parallel, their entities are merged in input order
+        for input_file, ranges in layout:
+            if not ranges:
+                yield next(results)
+                continue
+            parts = [next(results) for _ in ranges]
+            if None in parts:
+                yield None
+            else:
+                yield merge_ranges(scanner, input_file, ranges, parts, mapped=input_file in mapped_ranges)
+
+    records = []
+    # IPv4 addresses of each log, only given to its own anonymization
+    addresses = {}
+    for input_file, found in zip(collect_files, collected()):
+        nbfile += 1
+        filename = os.path.basename(input_file)
+        progress_line.update(file_size(input_file))
+        
+        dbglog('*** ' +  filename)
 
-        ### email 
-        Emails = find_pattern('Email', input_file)
-        try: 
-            for Email in Emails:
-                RandomEmail = str(generate_random_string())
-                Domain = extract_domain(Email)
-                if Domain and Domain not in Domain_set:
-                        Domain_set.add(Domain)
-                        RandomDomain = str(generate_random_string())
-                        element = (Domain, RandomDomain)
-                        DomainList.append(element)
-                if Email in Email_set:
-                    continue 
-                Email_set.add(Email)
-                RandomEmail = RandomEmail + '@' + RandomDomain
-                element = (Email, RandomEmail)
-                EmailList.append(element)
-        except:
-           pass
+        if found is None:
+            # Not readable, its error was reported and it is not read again for its addresses
+            addresses[input_file] = frozenset()
+            continue
+        addresses[input_file] = frozenset(found.get(ADDRESSES, ()))
 
-    # Clean list 
-    UniqueVeeamUsers = list(sorted(set(VeeamUserList)))
-    UniqueSMTPSevers = list(set(SMTPServerList))
-    UniquevCenters   = list(sorted(set(vCenterList)))
-    UniqueEmails     = list(set(EmailList))
-    UniqueESXi       = list(sorted(set(ESXiList)))
-    UniqueLocation   = list(sorted(set(LocationList)))
+        if phase == 'collect':
+            records.append((order[input_file], input_file, found))
+            continue
 
-    ### GET Domain and subdomain 
-    try:
-        for Domain in DomainList:
-            _Original, _Random = Domain
-            parts = _Original.split('.')
-            if len(parts) > 2:
-                main_domain = '.'.join(parts[-2:])
-                if main_domain not in Domain_set:
-                        Domain_set.add(main_domain)
-                        RandomDomain = str(generate_random_string())
-                        element = (main_domain, RandomDomain)
-                        DomainList.append(element)
-    except:
-        pass
+        mapping.add(found)
 
-    UniqueDomains    = list(set(DomainList))
+    progress_line.close()
+    lap('collect')
 
+    if phase == 'collect':
+        try:
+            write_collected(args.shared, args.shard, records, scanner.digest)
+        except OSError as e:
+            errlog('Error: cannot write the collected entities (' + str(e) + ')')
+            sys.exit(1)
+        stdlog('Entities of ' + str(len(records)) + ' file(s) written to ' + collected_path(args.shared, args.shard))
+        return
+
+    mapping.expand_domains()
+    lap('domain expansion')
+
+    anonymize_files = input_files
+    if store:
+        # Unchanged files already hold every pseudonym unless new entities were found
+        found_server = mapping.VeeamServer and not stored_server
+        if not found_server and stored == mapping.size():
+            anonymize_files = collect_files
+    if phase == 'apply':
+        try:
+            found_addresses = {record[0]: record[2].get(ADDRESSES, ()) for record in read_collected(args.shared)}
+        except (OSError, ValueError, KeyError) as e:
+            errlog('Error: cannot read the collected entities (' + str(e) + ')')
+            sys.exit(1)
+        for input_file in anonymize_files:
+            addresses[input_file] = frozenset(found_addresses.get(order[input_file], ()))
+    # The unchanged logs anonymized again with new entities are only scanned for their addresses
+    missing = [input_file for input_file in anonymize_files if input_file not in addresses]
+    if missing:
+        state = {'scanner': scanner, 'chunk_size': chunk_size, 'mapped': args.mmap, 'mapped_ranges': set()}
+        for input_file, found in zip(missing, run_tasks(collect_task, [(input_file, None, None) for input_file in missing], jobs, state)):
+            addresses[input_file] = frozenset(found.get(ADDRESSES, ())) if found else frozenset()
+        lap('addresses')
+    nbfile = len(anonymize_files)
+
+    sections = mapping.sections()
+    tables = dict(sections)
 
-    ## Cleaning ESXi 
-    filtered_ESXi = [(original, random) for (original, random) in UniqueESXi if original not in {vc[0] for vc in UniquevCenters}]
-    
     if args.dictionary: 
-        if not os.path.exists(output_directory) and args.force:
-            os.makedirs(output_directory)  
-        current_datetime = datetime.datetime.now()
-        formatted_datetime = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"VeeamAnonymizer-{formatted_datetime}.json"
-        outputdictfile  = output_directory + "/" + filename
-        # Add a new entry to the "Vcenter" section
-        for data in UniqueVeeamUsers:
-                _Original, _Random = data
-                update_json_file("VeeamUsers", _Original, _Random, outputdictfile)
-        for data in UniqueSMTPSevers:
-                _Original, _Random = data
-                update_json_file("SMTP Servers", _Original, _Random, outputdictfile)
-        for data in UniquevCenters:
-                _Original, _Random = data
-                update_json_file("vCenter Servers", _Original, _Random, outputdictfile)
-        for data in UniqueLocation:
-                _Original, _Random = data
-                update_json_file("vCenter Location", _Original, _Random, outputdictfile)
-        for data in UniqueEmails:
-                _Original, _Random = data
-                update_json_file("Email address", _Original, _Random, outputdictfile)
-        for data in filtered_ESXi: 
-                _Original, _Random = data
-                update_json_file("ESXi hosts", _Original, _Random, outputdictfile)
-        for data in UniqueDomains:
-                _Original, _Random = data
-                update_json_file("Domain names", _Original, _Random, outputdictfile)
-        stdlog('Json file created')
+        dump_dictionary(sections)
+        lap('dictionary')
 
 
     if args.mapping:
         # Show the mapping 
         ## VEEAM
         try:
-            stdlog('* Veeam Server : ' + VeeamServer + ' -> ' + RandomVeeamServer)
+            stdlog('* Veeam Server : ' + mapping.VeeamServer + ' -> ' + mapping.RandomVeeamServer)
         except: 
             pass
         
         ### SMTP
         try:
-            for SMTPServer in UniqueSMTPSevers:
+            for SMTPServer in tables['SMTP Servers']:
                 _OriginalSMTP, _RandomSMTP = SMTPServer
                 stdlog('* SMTP Server : ' + _OriginalSMTP + ' -> ' + _RandomSMTP)
         except: 
@@ -483,28 +3066,28 @@ def main():
         
         ### vCenter 
         try:
-            for vCenter in UniquevCenters:
+            for vCenter in tables['vCenter Servers']:
                 _Original, _Random = vCenter
                 stdlog('* vCenter Server : ' + _Original + ' -> ' + _Random)
         except: 
             pass
         # Location 
         try:
-            for Location in UniqueLocation:
+            for Location in tables['vCenter Location']:
                 _Original, _Random = Location
                 stdlog('* vCenter Location : ' + _Original + ' -> ' + _Random)
         except: 
             pass
         ### Domain 
         try:
-            for Domain in UniqueDomains:
+            for Domain in tables['Domain names']:
                 _Original, _Random = Domain
                 stdlog('* Domain : ' + _Original + ' -> ' + _Random)
         except: 
             pass
         ### Email 
         try:
-            for Email in UniqueEmails:
+            for Email in tables['Email address']:
                 _Original, _Random = Email
                 stdlog('* Email : ' + _Original + ' -> ' + _Random)
         except:
@@ -512,7 +3095,7 @@ def main():
         
         ### Veeam User Accounts 
         try:
-            for VeeamUser in UniqueVeeamUsers:
+            for VeeamUser in tables['VeeamUsers']:
                 _Original, _Random = VeeamUser
                 stdlog('* User: ' + _Original + ' -> ' + _Random)
         except: 
@@ -520,7 +3103,7 @@ def main():
 
         ### ESXi
         try:
-            for ESXi in filtered_ESXi:
+            for ESXi in tables['ESXi hosts']:
                 _Original, _Random = ESXi
                 stdlog('* ESXi: ' + _Original + ' -> ' + _Random)
         except:
@@ -532,109 +3115,131 @@ def main():
     ###
 
     i = 0 
-    ##  UniqueESXi = list(sorted(set(ESXiList)))
+
+    # Build the replacement engine once
+    replacer = mapping.replacer()
+    lap('mapping')
     
     stdlog('Processing anonymizing of ' + str(nbfile) + ' file(s) ... ')
-    for input_file in input_files:
-        filename = os.path.basename(input_file)
-        if args.input_file:
-            output_file = os.path.join(output_directory, filename)
-            full_output_directory = os.path.dirname(output_file)
-        else:
-            output_file = input_file.replace(args.input_directory,args.output_directory,1)
-            full_output_directory = os.path.dirname(output_file)
+    tasks = []
+    outputs = []
+    archives = {}
+    for input_file in anonymize_files:
+        ranges = ranges_of(input_file)
+        output_file = output_path(input_file)
+        archive, member = archive_member(output_file)
+        if member is not None:
+            # Anonymized to a temporary file, stored in the output archive at the end
+            archives.setdefault(archive, [])
+            output_file = archive + '.' + str(len(archives[archive])) + ('.gz' if member.endswith('.gz') else '')
+            archives[archive].append((output_file, member))
+        full_output_directory = os.path.dirname(output_file)
         
         if not os.path.exists(full_output_directory) and args.force:
             os.makedirs(full_output_directory)  
         
+        progress = None
         if verbose:
             i +=  1
-            file_size_bytes = os.path.getsize(input_file)
+            file_size_bytes = log_size(input_file)
             file_size_megabytes = round(file_size_bytes / (1024 * 1024),2)
-            stdlog('- Processing file ['+ str(i) + '/' + str(nbfile) + '] '+ input_file + '(' + str(file_size_megabytes)+ ' Mb)')
-        
-        try:
-            shutil.copy(input_file, output_file)
-        except:
+            progress = '- Processing file ['+ str(i) + '/' + str(nbfile) + '] '+ input_file + '(' + str(file_size_megabytes)+ ' Mb)'
+        if ranges and len(ranges) > 1:
+            parts = []
+            for index, (start, end) in enumerate(ranges):
+                parts.append(output_file + '.part' + str(index))
+                tasks.append((input_file, parts[-1], progress if index == 0 else None, start, end, addresses[input_file]))
+        else:
+            parts = None
+            start, end = ranges[0] if ranges else (None, None)
+            tasks.append((input_file, output_file, progress, start, end, addresses[input_file]))
+        outputs.append((input_file, output_file, parts))
+
+    # The mapping is built, the files are anonymized in parallel
+    results = run_tasks(anonymize_task, tasks, jobs, {'replacer': replacer, 'chunk_size': chunk_size},
+                        anonymize_pipeline if args.pipeline else None)
+    progress_line = Progress('Anonymizing', len(anonymize_files), sum(map(file_size, anonymize_files)), args.progress)
+    for input_file, output_file, parts in outputs:
+        processed = all([next(results) for _ in parts or [output_file]])
+        progress_line.update(file_size(input_file))
+        if processed and parts:
+            try:
+                join_parts(parts, output_file)
+            except OSError:
+                processed = False
+        if not processed:
             errlog('Fatal Error processing : ' + input_file + ' --> ' + output_file)
             sys.exit(1)
-
-        try:
-            replace_string_in_file(output_file,output_file, VeeamServer, RandomVeeamServer)
-        except: 
-            pass
-
-
-        try: 
-            for ESXi in filtered_ESXi:
-                _Original, _Random = ESXi
-                dbglog('    + anonymizing ESXi')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except: 
-            pass
-
-
-        try:
-            for Domain in UniqueDomains:
-                _Original, _Random = Domain
-                dbglog('    + anonymizing Domain')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except: 
-            pass
-    
-        try:
-            for SMTPServer in UniqueSMTPSevers:
-                _Original, _Random = SMTPServer
-                dbglog('    + anonymizing SMTPServer')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except: 
-            pass
-
+    for archive, members in archives.items():
+        import zipfile
         try:
-            for vCenter in UniquevCenters:
-                _Original, _Random = vCenter
-                dbglog('    + anonymizing vCenter')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except: 
-            pass
-    
-        try:
-            for VeeamUser in UniqueVeeamUsers:
-                _Original, _Random = VeeamUser
-                dbglog('    + anonymizing VeeamUser')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except: 
-            pass
-
-        try:
-            for Email in UniqueEmails:
-                _Original, _Random = Email
-                dbglog('    + anonymizing Email')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except:
-            pass
-
-        try:
-            for Location in UniqueLocation:
-                _Original, _Random = Location
-                dbglog('    + anonymizing Location')
-                replace_string_in_file(output_file,output_file, _Original, _Random)
-        except:
-            pass   
+            write_archive(archive, members)
+        except (OSError, zipfile.BadZipFile) as e:
+            errlog('Fatal Error writing ' + archive + ' : ' + str(e))
+            sys.exit(1)
+    progress_line.close()
+    lap('anonymize')
+    if store:
+        mapping.save(store)
+        store.save_fingerprints()
+        store.commit()
+        store.close()
+        lap('store')
+
+    leaks = unverified = 0
+    if args.verify:
+        # Every output, also the ones of the files unchanged since the last run
+        verify_files = [output_path(input_file) for input_file in input_files]
+        stdlog('Verifying ' + str(len(verify_files)) + ' file(s)')
+        layout = []
+        tasks = []
+        for verify_file_path in verify_files:
+            ranges = ranges_of(verify_file_path)
+            layout.append((verify_file_path, ranges))
+            tasks.extend((verify_file_path, start, end) for start, end in ranges or [(None, None)])
+        results = run_tasks(verify_task, tasks, jobs, {'replacer': replacer, 'chunk_size': chunk_size or PIPELINE_CHUNK_SIZE})
+        progress_line = Progress('Verifying', len(verify_files), sum(map(file_size, verify_files)), args.progress)
+        for verify_file_path, ranges in layout:
+            parts = [next(results) for _ in ranges or [None]]
+            progress_line.update(file_size(verify_file_path))
+            if None in parts:
+                unverified += 1
+                continue
+            for found in parts:
+                for offset, category in found:
+                    errlog('Leak: ' + verify_file_path + ' at offset ' + str(offset) + ' (' + category + ')')
+                    leaks += 1
+        progress_line.close()
+        lap('verify')
+        if leaks or unverified:
+            errlog('Verification failed: ' + str(leaks) + ' leak(s), ' + str(unverified) + ' file(s) not verified')
+        else:
+            stdlog('Verification passed: no original value left in the output files')
 
-        # For IPs
-        dbglog('    + anonymizing IP Address')
-        process_IP(output_file,output_file)
-        dbglog('- File ' + input_file + ' processed')
     end_time = time.time()
     elapsed_time = end_time - start_time
     minutes = str(int(elapsed_time // 60))
     seconds = str(int(elapsed_time % 60))
     stdlog('Anonymizng finished in ' + minutes + '  minutes and ' + seconds + ' seconds')
 
+    if stats:
+        report = stats.report(elapsed_time, version=__version__, jobs=jobs, stream=bool(chunk_size),
+                              input_files=len(input_files), collected_files=len(collect_files), anonymized_files=len(anonymize_files))
+        try:
+            with open(args.stats, 'w') as stats_file:
+                json.dump(report, stats_file, indent=4)
+            stdlog('Statistics written to ' + args.stats)
+        except OSError as e:
+            errlog('Error: cannot write the statistics (' + str(e) + ')')
+
+    if leaks or unverified:
+        sys.exit(1)
+
 if __name__ == "__main__":
-    start_time = time.time()
-    print(
+    configure_logging()
+    # In filter mode the standard output is the anonymized log, no banner
+    if '-' not in sys.argv[1:]:
+        print(
     f'''
 .-.   .-.,---.  ,---.    .--.                   ,-.    .---.    ,--,              .--.  .-. .-. .---.  .-. .-..-.   .-.        ,-. _____  ,---.  ,---.    
  \ \ / / | .-'  | .-'   / /\ \ |\    /|         | |   / .-. ) .' .'              / /\ \ |  \| |/ .-. ) |  \| | \ \_/ )/|\    /||(|/___  / | .-'  | .-.\   
@@ -645,5 +3250,5 @@ if __name__ == "__main__":
         (__)   (__)            '-'  '-'         (_)   (_)     (__)                     (__)    (_)    (__)     (__)    '-'  '-'          (__) v {__version__}  (__) 
     by Julien Mousqueton (@JMousqueton)
     '''
-    )
+        )
     main()
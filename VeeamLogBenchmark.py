@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = "Julien Mousqueton"
+__copyright__ = "Copyright 2025, Julien Mousqueton"
+__version__ = "1.2"
+
+# Import necessary modules
+import os
+import sys
+import random
+import argparse
+import json
+import time
+import datetime
+import platform
+import tempfile
+import shutil
+import subprocess
+
+import VeeamLogAnonymizer as anonymizer
+from VeeamLogAnonymizer import stdlog, errlog
+
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+FILLER = [
+    "Info     [ProxyAgent] Processing disk {disk} of VM {vm}, {percent}% done",
+    "Info     Task session [{uuid}] state: Working",
+    "Info     [Transport] Read {size} bytes from block {block}",
+    "Info     Job session has been updated, processed objects: {percent}",
+    "Warning  [Transport] Retrying read of block {block}, attempt {attempt}",
+    "Info     [CBT] Changed blocks: {block}, size: {size}",
+]
+
+
+class SyntheticEntities:
+    '''Fake but realistic entities of a Veeam Backup & Replication infrastructure'''
+
+    def __init__(self, generator, hosts=20, users=5, emails=5, locations=5):
+        domains = ['corp%02d.example.com' % index for index in range(max(1, hosts // 10))]
+        self.server = 'VBR%02d' % generator.randint(1, 99)
+        self.domain = domains[0]
+        self.vcenters = ['vcsa%02d.%s' % (index, generator.choice(domains)) for index in range(max(1, hosts // 20))]
+        self.esxi = ['esx%03d.%s' % (index, generator.choice(domains)) for index in range(hosts)]
+        self.smtp = ['smtp%02d.%s' % (index, generator.choice(domains)) for index in range(max(1, hosts // 20))]
+        self.users = ['CORP\\svc_user%02d' % index for index in range(users)]
+        self.emails = ['backup.admin%02d@%s' % (index, generator.choice(domains)) for index in range(emails)]
+        self.locations = ['Datacenter%02d\\Cluster%02d\\Host' % (index // 2, index) for index in range(locations)]
+
+
+def random_ipv4(generator):
+    # 7. and 8. are left unmasked by the anonymizer (vSphere versions)
+    return '%d.%d.%d.%d' % (generator.choice([10, 172, 192]), generator.randint(0, 255), generator.randint(0, 255), generator.randint(1, 254))
+
+
+def random_ipv6(generator):
+    return '2001:db8:%x:%x::%x' % (generator.randint(0, 0xffff), generator.randint(0, 0xffff), generator.randint(1, 0xffff))
+
+
+def synthetic_line(generator, entities, timestamp):
+    '''Return one log line, about one in four lines holds an entity or an address'''
+    kind = generator.randint(0, 40)
+    if kind == 0:
+        message = "Info     HostName: [%s]" % entities.server
+    elif kind == 1:
+        message = "Info     Location: [%s]" % generator.choice(entities.locations)
+    elif kind == 2:
+        message = "Info     [Notification] SMTP Server '%s' port 25" % generator.choice(entities.smtp)
+    elif kind == 3:
+        message = "Info     Target host: [%s]" % generator.choice(entities.esxi)
+    elif kind == 4:
+        message = "Info     Connecting to HostNameOrIpAddress: '%s' port 443" % generator.choice(entities.vcenters)
+    elif kind == 5:
+        message = "Info     Sending report to %s" % generator.choice(entities.emails)
+    elif kind == 6:
+        message = "Info     Log has been started by '%s'" % generator.choice(entities.users)
+    elif kind == 7:
+        message = "Info     [Soap] Connecting to %s:902 from %s" % (random_ipv4(generator), random_ipv4(generator))
+    elif kind == 8:
+        message = "Info     [Rpc] Accepted connection from [::ffff:%s]" % random_ipv4(generator)
+    elif kind == 9:
+        message = "Info     [Rpc] Accepted connection from [%s]:6160" % random_ipv6(generator)
+    elif kind == 10:
+        message = "Info     vSphere version 8.0.%d.%d, host %s" % (generator.randint(0, 3), generator.randint(10000, 99999), generator.choice(entities.esxi))
+    else:
+        message = generator.choice(FILLER).format(
+            disk=generator.randint(0, 8), vm='VM%04d' % generator.randint(0, 9999),
+            percent=generator.randint(0, 100), uuid='%032x' % generator.getrandbits(128),
+            size=generator.randint(0, 1 << 30), block=generator.randint(0, 1 << 20),
+            attempt=generator.randint(1, 5))
+    return '[%s] <%02d> %s\n' % (timestamp.strftime('%d.%m.%Y %H:%M:%S.%f')[:-3], generator.randint(1, 99), message)
+
+
+def generate_logs(output_directory, files=4, size=16, hosts=20, users=5, emails=5, locations=5, seed=0):
+    '''Write files synthetic logs of size MB each, return their paths'''
+    generator = random.Random(seed)
+    entities = SyntheticEntities(generator, hosts, users, emails, locations)
+    os.makedirs(output_directory, exist_ok=True)
+    paths = []
+    for index in range(files):
+        path = os.path.join(output_directory, 'Job.Backup_%02d.log' % index)
+        timestamp = datetime.datetime(2025, 1, 1) + datetime.timedelta(days=index)
+        written = 0
+        with open(path, 'w', encoding='utf-8') as log_file:
+            log_file.write("[%s] <01> Info     Log has been started by '%s'\n" % (timestamp.strftime('%d.%m.%Y %H:%M:%S.000'), entities.users[0] if entities.users else 'CORP\\veeam'))
+            while written < size * 1024 * 1024:
+                lines = []
+                for _ in range(1000):
+                    timestamp += datetime.timedelta(milliseconds=generator.randint(0, 500))
+                    lines.append(synthetic_line(generator, entities, timestamp))
+                block = ''.join(lines)
+                log_file.write(block)
+                written += len(block)
+        paths.append(path)
+    return paths
+
+
+def measure(name, function, size):
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    stdlog('%-12s %8.3f s %10.2f MB/s' % (name, seconds, size / 1e6 / seconds if seconds else 0))
+    return result, {'seconds': round(seconds, 6), 'mb_per_s': round(size / 1e6 / seconds, 3) if seconds else None}
+
+
+def run_benchmark(input_files, work_directory, chunk_size=None, jobs=1, cli=True, patterns=None):
+    '''Time the phases of an anonymization of input_files, return the results'''
+    scanner = anonymizer.load_patterns(patterns)
+    size = sum(os.path.getsize(path) for path in input_files)
+    phases = {}
+
+    def collect():
+        return [anonymizer.collect_file(scanner, path, chunk_size) for path in input_files]
+
+    collected, phases['collect'] = measure('collect', collect, size)
+    mapping = anonymizer.EntityMapping()
+
+    def build():
+        # As the anonymizer does: domains, precedence and the FQDN rewriting included
+        for found in collected:
+            mapping.add(found)
+        mapping.expand_domains()
+        return mapping.replacer()
+
+    replacer, phases['replacer'] = measure('replacer', build, size)
+
+    output_directory = os.path.join(work_directory, 'output')
+    os.makedirs(output_directory, exist_ok=True)
+
+    def anonymize():
+        for path, found in zip(input_files, collected):
+            anonymizer.anonymize_file(path, os.path.join(output_directory, os.path.basename(path)), replacer, chunk_size,
+                                      addresses=frozenset(found[anonymizer.ADDRESSES]))
+
+    _, phases['anonymize'] = measure('anonymize', anonymize, size)
+
+    dictionary_file = os.path.join(work_directory, 'VeeamAnonymizer-benchmark.json')
+    _, phases['dictionary'] = measure('dictionary', lambda: anonymizer.write_dictionary(mapping.sections(), dictionary_file), size)
+
+    if cli:
+        # The whole command line, as run by the users
+        command = [sys.executable, os.path.join(SCRIPT_DIRECTORY, 'VeeamLogAnonymizer.py'), '-o', os.path.join(work_directory, 'cli'), '-f', '-D', '-j', str(jobs)]
+        command += ['-d', os.path.commonpath(input_files)] if len(input_files) > 1 else ['-i', input_files[0]]
+        if chunk_size:
+            command += ['--stream']
+        for pack in patterns or []:
+            command += ['-P', pack]
+        _, phases['end_to_end'] = measure('end to end', lambda: subprocess.run(command, cwd=SCRIPT_DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True), size)
+
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'version': anonymizer.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'files': len(input_files),
+        'bytes': size,
+        'entities': {kind: len(dict.fromkeys(value for found in collected for value in found[kind])) for kind in scanner.kinds},
+        'mappings': mapping.size(),
+        'stream': bool(chunk_size),
+        'jobs': jobs,
+        'patterns': scanner.digest,
+        'phases': phases,
+    }
+
+
+# Fillers of the malformed lines, each one keeps a different kind of
+# pattern from finding its terminator
+STRESS_FILLERS = (' ', 'a', "'", '[', ' [', '.', '@', '\\')
+
+
+def best_seconds(function, repeat=3):
+    '''Shortest of repeat runs of function, without the pauses of the machine'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def stress_seconds(pattern, literal, size):
+    '''Worst time of a pattern over malformed lines of size characters: its
+    literal followed by a filler, or literal and filler repeated (every
+    occurrence of the literal then scans to the end of the line)'''
+    worst = 0.0
+    for filler in STRESS_FILLERS:
+        unit = literal + filler
+        for line in (literal + filler * size, unit * max(1, size // len(unit))):
+            worst = max(worst, best_seconds(lambda: pattern.findall(line)))
+    return worst
+
+
+def profile_patterns(scanner, input_files, stress_size=8192):
+    '''Time every pattern of a pack over logs, return the report of each kind
+
+    The throughput is the one of the collection (same literal search and
+    regex scan). Every line holding the literal of a pattern is timed alone
+    to find the most expensive one, and malformed lines of stress_size and
+    stress_size / 2 characters show how the pattern grows on long lines.
+    The worst line is located relative to the directory of the logs, the
+    synthetic ones are generated again with the same seed.
+    '''
+    size = sum(os.path.getsize(path) for path in input_files)
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in input_files])
+    # The pattern timings are gathered by the module statistics, the ones of a caller are kept
+    previous = anonymizer.stats
+    anonymizer.stats = anonymizer.Stats()
+    try:
+        for path in input_files:
+            anonymizer.collect_file(scanner, path)
+        totals = anonymizer.stats.patterns
+    finally:
+        anonymizer.stats = previous
+
+    worst = {kind: (0.0, None) for kind in scanner.kinds}
+    for path in input_files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as log_file:
+            for number, line in enumerate(log_file, 1):
+                for kind, pattern in scanner.patterns.items():
+                    literal = scanner.literals[kind][0]
+                    if literal and literal not in line:
+                        continue
+                    start = time.perf_counter()
+                    pattern.findall(line)
+                    seconds = time.perf_counter() - start
+                    if seconds > worst[kind][0]:
+                        # Timed again, a single run may include a pause of the machine
+                        seconds = min(seconds, best_seconds(lambda: pattern.findall(line), 2))
+                        if seconds > worst[kind][0]:
+                            worst[kind] = (seconds, os.path.relpath(os.path.abspath(path), root) + ':' + str(number))
+
+    report = {}
+    for kind, pattern in scanner.patterns.items():
+        matches, seconds = totals.get(kind, (0, 0.0))
+        literal = scanner.literals[kind][0]
+        stress = stress_seconds(pattern, literal, stress_size)
+        half = stress_seconds(pattern, literal, stress_size // 2)
+        report[kind] = {
+            'matches': matches,
+            'seconds': round(seconds, 6),
+            'ms_per_mb': round(seconds * 1000 / (size / 1e6), 3) if size else None,
+            'worst_line_us': round(worst[kind][0] * 1e6, 1),
+            'worst_line': worst[kind][1],
+            'stress_ms': round(stress * 1000, 3),
+            # About 2 for a linear pattern, 4 or more when it backtracks
+            'stress_growth': round(stress / half, 2) if half else None,
+        }
+    return size, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Veeam Backup & Replication logs and benchmark the anonymizer.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Write synthetic logs")
+    run_parser = subparsers.add_parser("run", help="Benchmark the anonymization of logs, synthetic ones unless -d is given")
+    for subparser in (generate_parser, run_parser):
+        subparser.add_argument("--files", type=int, default=4, help="Number of log files (default: 4)")
+        subparser.add_argument("--size", type=int, default=16, metavar="MB", help="Size of each log file in MB (default: 16)")
+        subparser.add_argument("--hosts", type=int, default=20, help="Number of ESXi hosts, vCenters, SMTP servers and domains scale with it (default: 20)")
+        subparser.add_argument("--users", type=int, default=5, help="Number of Veeam users (default: 5)")
+        subparser.add_argument("--emails", type=int, default=5, help="Number of report email addresses (default: 5)")
+        subparser.add_argument("--locations", type=int, default=5, help="Number of vCenter locations (default: 5)")
+        subparser.add_argument("--seed", type=int, default=0, help="Seed of the generator, the same seed gives the same logs (default: 0)")
+    generate_parser.add_argument("-o", "--output", dest="output_directory", required=True, help="Output directory of the synthetic logs")
+    run_parser.add_argument("-d", "--directory", dest="input_directory", help="Benchmark the .log files of this directory instead of synthetic logs")
+    run_parser.add_argument("-r", "--results", default="VeeamBenchmark.jsonl", help="File the results are appended to, one JSON object per run (default: VeeamBenchmark.jsonl)")
+    run_parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="Number of worker processes of the end to end run (default: 1)")
+    run_parser.add_argument("--stream", action="store_true", help="Process the logs by chunks of --max-memory")
+    run_parser.add_argument("--max-memory", dest="max_memory", type=int, default=64, metavar="MB", help="Memory ceiling in MB with --stream (default: 64)")
+    run_parser.add_argument("--no-cli", dest="cli", action="store_false", help="Do not time the whole command line")
+    patterns_parser = subparsers.add_parser("patterns", help="Profile each pattern of a pattern pack over logs, synthetic ones unless -d is given")
+    patterns_parser.add_argument("-d", "--directory", dest="input_directory", help="Profile over the .log files of this directory instead of synthetic logs")
+    patterns_parser.add_argument("--files", type=int, default=1, help="Number of synthetic log files (default: 1)")
+    patterns_parser.add_argument("--size", type=int, default=16, metavar="MB", help="Size of each synthetic log file in MB (default: 16)")
+    patterns_parser.add_argument("--seed", type=int, default=0, help="Seed of the generator (default: 0)")
+    patterns_parser.add_argument("--stress-size", dest="stress_size", type=int, default=8192, metavar="CHARS", help="Length of the malformed lines each pattern is run against (default: 8192)")
+    patterns_parser.add_argument("-r", "--results", default="VeeamPatterns.jsonl", help="File the profile is appended to, one JSON object per run (default: VeeamPatterns.jsonl)")
+    for subparser in (run_parser, patterns_parser):
+        subparser.add_argument("-P", "--patterns", action="append", metavar="PACK", help="Pattern pack: default (patterns.json), a pack name or a file, repeat it to combine packs")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        paths = generate_logs(args.output_directory, args.files, args.size, args.hosts, args.users, args.emails, args.locations, args.seed)
+        stdlog(str(len(paths)) + ' synthetic log(s) written to ' + args.output_directory)
+        return
+
+    try:
+        scanner = anonymizer.load_patterns(args.patterns)
+    except (OSError, ValueError) as e:
+        errlog('Error: invalid pattern pack (' + str(e) + ')')
+        sys.exit(1)
+
+    work_directory = tempfile.mkdtemp(prefix='VeeamBenchmark-')
+    try:
+        if args.input_directory:
+            input_files = sorted(os.path.join(root, filename) for root, _, files in os.walk(args.input_directory) for filename in files if filename.endswith('.log'))
+            if not input_files:
+                errlog('Error: no .log file in ' + args.input_directory)
+                sys.exit(1)
+        elif args.command == "patterns":
+            stdlog('Generating ' + str(args.files) + ' synthetic log(s) of ' + str(args.size) + ' MB')
+            input_files = generate_logs(os.path.join(work_directory, 'input'), args.files, args.size, seed=args.seed)
+        else:
+            stdlog('Generating ' + str(args.files) + ' synthetic log(s) of ' + str(args.size) + ' MB')
+            input_files = generate_logs(os.path.join(work_directory, 'input'), args.files, args.size, args.hosts, args.users, args.emails, args.locations, args.seed)
+        if args.command == "patterns":
+            size, report = profile_patterns(scanner, input_files, args.stress_size)
+            stdlog('%-12s %8s %10s %12s %12s %7s  %s' % ('pattern', 'matches', 'ms/MB', 'worst line', 'stress', 'growth', 'worst line at'))
+            for kind, entry in report.items():
+                stdlog('%-12s %8d %10.3f %9.1f us %9.3f ms %7s  %s' % (kind, entry['matches'], entry['ms_per_mb'] or 0, entry['worst_line_us'],
+                                                                       entry['stress_ms'], entry['stress_growth'], entry['worst_line'] or '-'))
+            for warning in scanner.warnings:
+                stdlog('warning: ' + warning)
+            result = {
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'version': anonymizer.__version__,
+                'python': platform.python_version(),
+                'packs': args.patterns or ['default'],
+                'patterns': scanner.digest,
+                'files': len(input_files),
+                'bytes': size,
+                'stress_size': args.stress_size,
+                'kinds': report,
+                'warnings': scanner.warnings,
+            }
+            with open(args.results, 'a') as results_file:
+                results_file.write(json.dumps(result) + '\n')
+            stdlog('Profile appended to ' + args.results)
+            return
+        chunk_size = args.max_memory * 1024 * 1024 // 4 if args.stream else None
+        try:
+            result = run_benchmark(input_files, work_directory, chunk_size, args.jobs, args.cli, args.patterns)
+        except subprocess.CalledProcessError as e:
+            errlog('Error: the anonymizer failed with exit code ' + str(e.returncode))
+            sys.exit(1)
+        with open(args.results, 'a') as results_file:
+            results_file.write(json.dumps(result) + '\n')
+        stdlog('Results appended to ' + args.results)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    anonymizer.configure_logging()
+    main()
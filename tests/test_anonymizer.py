@@ -0,0 +1,17 @@
+import VeeamLogAnonymizer as anonymizer
+
+LOG = ("[17.10.2026 10:00:00] <01> Info     Log has been started by 'CORP\\backup'\n"
+       "[17.10.2026 10:00:01] <01> Info     Target host: [esx01.corp.example.com]\n")
+
+
+def test_instances_keep_their_key():
+    # Pseudonyms are generated lazily: the key of an instance must not be
+    # replaced by the one of an instance created later
+    first = anonymizer.Anonymizer(key='first')
+    second = anonymizer.Anonymizer(key='second')
+    again = anonymizer.Anonymizer(key='first')
+    text = first.anonymize(LOG)
+    assert text != LOG
+    assert second.anonymize(LOG) != text
+    assert again.anonymize(LOG) == text
+    assert anonymizer.Anonymizer().mapping.key is None
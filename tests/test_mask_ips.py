@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'VeeamLogAnonymizer.py')
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('[10.1.2.3]:443 from 10.1.2.3', '[**.**.2.3]:443 from **.**.2.3'),
+    ('from 10.4.5.6 then [10.4.5.6]', 'from **.**.5.6 then [**.**.5.6]'),
+    ('[::ffff:10.7.8.9] and [10.7.8.9]', '[::ffff:**.**.8.9] and [**.**.8.9]'),
+    # Versions are bracketed, they are not addresses found elsewhere
+    ('Veeam [12.1.2.172]', 'Veeam [12.1.2.172]'),
+    ('vSphere 7.0.3.1 and 8.0.2.1', 'vSphere 7.0.3.1 and 8.0.2.1'),
+])
+def test_ipv4(text, expected):
+    assert anonymizer.mask_IPs(text, anonymizer.find_IPv4(text)) == expected
+
+
+def test_bracketed_copies_need_their_log():
+    assert anonymizer.mask_IPs('peer [10.1.2.3]') == 'peer [10.1.2.3]'
+    assert anonymizer.mask_IPs('peer [10.1.2.3]', {'10.1.2.3'}) == 'peer [**.**.2.3]'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('from fe80::1 ok', 'from ****:****:****:****::1 ok'),
+    ('2001:db8::1:0:0:1', '****:****:****:****:1::1'),
+    ('2001:DB8:1:2:3:4:5:6', '****:****:****:****:3:4:5:6'),
+    ('[fe80::a00:27ff:fe4e:66a1%12]', '[****:****:****:****:a00:27ff:fe4e:66a1%12]'),
+    # Not addresses
+    ('Job :: started', 'Job :: started'),
+    ('lo ::1', 'lo ::1'),
+    ('C:\\a::b', 'C:\\a::b'),
+    ('wwpn 20:00:00:25:b5:aa:00:1f', 'wwpn 20:00:00:25:b5:aa:00:1f'),
+    ('mac 00:25:b5:aa:00:1f at 12:30:45', 'mac 00:25:b5:aa:00:1f at 12:30:45'),
+])
+def test_ipv6(text, expected):
+    assert anonymizer.mask_IPs(text) == expected
+
+
+def run(tmp_path, logs, *options):
+    source = tmp_path / 'logs'
+    source.mkdir()
+    for name, content in logs.items():
+        (source / name).write_text(content)
+    output = tmp_path / 'out'
+    subprocess.run([sys.executable, SCRIPT, '-d', str(source), '-o', str(output), '-f', *options],
+                   check=True, capture_output=True)
+    return {name: (output / name).read_text() for name in logs}
+
+
+FILLER = ''.join('[17.10.2026 10:00:%02d] <01> Info     line %d of the job\n' % (index % 60, index) for index in range(40000))
+
+
+@pytest.mark.parametrize('options', [(), ('--stream', '--max-memory', '1'), ('-j', '2', '--split-size', '1'), ('--mmap', '-j', '2', '--split-size', '1')])
+def test_bracketed_copy_before_the_address(tmp_path, options):
+    # The address is found after its bracketed copy, in another chunk or range
+    log = 'peer [10.1.2.3]\n' + FILLER + 'from 10.1.2.3\n'
+    output = run(tmp_path, {'Job.log': log}, *options)['Job.log']
+    assert output.startswith('peer [**.**.2.3]\n')
+    assert '10.1.2.3' not in output
+
+
+@pytest.mark.parametrize('options', [(), ('-j', '4', '--split-size', '1')])
+def test_addresses_of_another_log(tmp_path, options):
+    # An address of a.log does not mask a version like copy in b.log
+    logs = {'a.log': 'from 10.9.9.9\n', 'b.log': 'peer [10.9.9.9]\n'}
+    output = run(tmp_path, logs, *options)
+    assert output == {'a.log': 'from **.**.9.9\n', 'b.log': 'peer [10.9.9.9]\n'}
+
+
+def test_addresses_of_the_shards(tmp_path):
+    logs = {'a.log': 'from 10.9.9.9\n', 'b.log': 'peer [10.8.8.8]\nfrom 10.8.8.8\n'}
+    source = tmp_path / 'logs'
+    source.mkdir()
+    for name, content in logs.items():
+        (source / name).write_text(content)
+    shared = str(tmp_path / 'shared')
+    output = tmp_path / 'out'
+    for phase, shard in (('collect', '0/2'), ('collect', '1/2'), ('merge', None), ('apply', '0/2'), ('apply', '1/2')):
+        command = [sys.executable, SCRIPT, phase, '--shared', shared]
+        if shard:
+            command += ['-d', str(source), '-o', str(output), '-f', '--shard', shard]
+        subprocess.run(command, check=True, capture_output=True)
+    assert (output / 'a.log').read_text() == 'from **.**.9.9\n'
+    assert (output / 'b.log').read_text() == 'peer [**.**.8.8]\nfrom **.**.8.8\n'
+
+
+def test_anonymizer_instances():
+    first = anonymizer.Anonymizer()
+    assert first.anonymize('from 172.16.5.5\n') == 'from **.**.5.5\n'
+    assert anonymizer.Anonymizer().anonymize('peer [172.16.5.5]\n') == 'peer [172.16.5.5]\n'
+    assert first.anonymize('peer [172.16.5.5]\n') == 'peer [172.16.5.5]\n'
+    addresses = set()
+    assert first.anonymize('from 172.16.5.5\n', addresses=addresses) == 'from **.**.5.5\n'
+    assert first.anonymize('peer [172.16.5.5]\n', addresses=addresses) == 'peer [**.**.5.5]\n'
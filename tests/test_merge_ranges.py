@@ -0,0 +1,63 @@
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+
+# An unterminated "HostName: [" swallows the next lines up to the first "]",
+# the "HostName: [hidden-srv]" it hides is found by the scan of a later range
+LINES = (['[16.10.2026 10:15:%02d.000] <01> Info filler line %d' % (i, i) for i in range(12)]
+         + ['[16.10.2026 10:16:00.000] <01> Info HostName: [open-host']
+         + ['    continued %d' % i for i in range(1, 6)]
+         + ['    HostName: [hidden-srv] Target host: [esx01.lab]']
+         + ['[16.10.2026 10:17:%02d.000] <01> Info filler line %d' % (i, i) for i in range(12)]
+         + ['[16.10.2026 10:18:00.000] <01> Info HostName: [after-srv]'])
+
+
+@pytest.fixture(scope='module')
+def scanner():
+    return anonymizer.load_patterns()
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = tmp_path / 'Job.log'
+    path.write_bytes(('\n'.join(LINES) + '\n').encode('utf-8'))
+    return str(path)
+
+
+@pytest.mark.parametrize('mapped', [False, True])
+@pytest.mark.parametrize('size', [1, 64, 300, 700])
+def test_ranges_merge_as_a_single_scan(scanner, log, size, mapped):
+    ranges = anonymizer.split_file(log, size)
+    results = [anonymizer.collect_range(scanner, log, start, end, overlap=4096, mapped=mapped) for start, end in ranges]
+    merged = anonymizer.merge_ranges(scanner, log, ranges, results, overlap=4096, mapped=mapped)
+    assert merged == anonymizer.collect_file(scanner, log)
+
+
+def test_match_straddling_a_boundary(scanner, log):
+    # Each line is its own range, the first match ends four ranges further
+    ranges = anonymizer.split_file(log, 1)
+    results = [anonymizer.collect_range(scanner, log, start, end, overlap=4096) for start, end in ranges]
+    servers = anonymizer.merge_ranges(scanner, log, ranges, results, overlap=4096)['VeeamServer']
+    assert len(servers) == 2
+    assert servers[0].startswith('open-host\n') and servers[0].endswith('HostName: [hidden-srv')
+    assert servers[1] == 'after-srv'
+    # The hidden match is dropped, the next pattern is not affected
+    assert 'hidden-srv' not in servers
+    assert 'esx01.lab' in anonymizer.merge_ranges(scanner, log, ranges, results, overlap=4096)['ESXiServer']
+
+
+def test_range_resynchronized_after_a_hidden_match(tmp_path):
+    # The first quote after "Note: 'open" is the one of the second note, the
+    # real scan goes on after it and finds "Note: 'c'". The scan of the next
+    # range starts at the second note instead and finds "Note: 'inner Note: '"
+    # hiding "Note: 'c'": the merge searches that range again.
+    scanner = anonymizer.compile_patterns({'Note': "(?s)Note: '(.*?)'"})
+    path = tmp_path / 'Job.log'
+    path.write_bytes(b"Note: 'open\nfiller\nNote: 'inner Note: 'c'\nfiller\nNote: 'last'\n")
+    log = str(path)
+    ranges = anonymizer.split_file(log, 1)
+    results = [anonymizer.collect_range(scanner, log, start, end, overlap=4096) for start, end in ranges]
+    merged = anonymizer.merge_ranges(scanner, log, ranges, results, overlap=4096)
+    assert merged == anonymizer.collect_file(scanner, log)
+    assert merged['Note'] == ['open\nfiller\nNote: ', 'c', 'last']
@@ -0,0 +1,26 @@
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+
+@pytest.mark.parametrize('content, expected', [
+    (b'a' * 100 + b'Secret-Host' + b'b' * 100, True),
+    (b'a' * 100 + b'from 10.1.2.3\n' + b'b' * 100, True),
+    (b'a' * 100 + 'hôte'.encode('utf-8') + b'b' * 100, True),
+    (b'a' * 100 + b'secret-hos' + b'b' * 100, False),
+])
+@pytest.mark.parametrize('block_size', [1, 7, 64, 105, 1000])
+def test_blocks(tmp_path, content, expected, block_size):
+    # Values and addresses cut by a block end are found in the next block
+    log = tmp_path / 'Job.log'
+    log.write_bytes(content)
+    replacer = anonymizer.Replacer([('secret-host', 'x')])
+    assert anonymizer.needs_anonymization(replacer, str(log), block_size=block_size) is expected
+
+
+def test_range(tmp_path):
+    log = tmp_path / 'Job.log'
+    log.write_bytes(b'clean line\nsecret-host\nclean line\n')
+    replacer = anonymizer.Replacer([('secret-host', 'x')])
+    assert not anonymizer.needs_anonymization(replacer, str(log), 0, 11)
+    assert anonymizer.needs_anonymization(replacer, str(log), 11, 23)
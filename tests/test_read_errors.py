@@ -0,0 +1,63 @@
+import gzip
+import zipfile
+
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+LOG = ("[17.10.2026 10:00:00] <01> Info     Log has been started by 'CORP\\backup'\n" * 1000).encode()
+
+
+def truncated(tmp_path):
+    # A gzip log copied while it was written
+    log = tmp_path / 'job.log.gz'
+    data = gzip.compress(LOG)
+    log.write_bytes(data[:len(data) // 2])
+    return log
+
+
+def corrupt(tmp_path):
+    log = tmp_path / 'job.log.gz'
+    data = gzip.compress(LOG)
+    log.write_bytes(data[:20] + b'\0' * 50 + data[70:])
+    return log
+
+
+def bad_member(tmp_path):
+    # The CRC of the member does not match its data
+    archive = tmp_path / 'bundle.zip'
+    with zipfile.ZipFile(archive, 'w') as bundle:
+        bundle.writestr('Job.log', LOG)
+    data = archive.read_bytes()
+    offset = data.index(b'Log has been')
+    archive.write_bytes(data[:offset] + b'X' + data[offset + 1:])
+    return str(archive) + '!Job.log'
+
+
+@pytest.fixture(params=[truncated, corrupt, bad_member])
+def log(request, tmp_path):
+    anonymizer.zip_archives.clear()
+    return str(request.param(tmp_path))
+
+
+@pytest.fixture
+def state():
+    anonymizer.worker_state.update({'scanner': anonymizer.load_patterns(), 'chunk_size': None, 'mapped': False,
+                                    'mapped_ranges': set(), 'replacer': anonymizer.Replacer([('CORP\\backup', 'x')])})
+
+
+def test_collect(log, state, caplog):
+    assert anonymizer.collect_task((log, None, None)) is None
+    assert list(anonymizer.collect_pipeline([(log, None, None)])) == [None]
+    assert [record.getMessage().startswith('Error reading ' + log) for record in caplog.records] == [True, True]
+
+
+def test_anonymize(log, state, tmp_path):
+    output = str(tmp_path / 'out.log')
+    assert anonymizer.anonymize_task((log, output, None, None, None, frozenset())) is False
+    assert list(anonymizer.anonymize_pipeline([(log, output, None, None, None, frozenset())])) == [False]
+
+
+def test_verify(log, state, caplog):
+    assert anonymizer.verify_task((log, None, None)) is None
+    assert caplog.records[0].getMessage().startswith('Error reading ' + log)
@@ -0,0 +1,40 @@
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+SALT = b'salt'
+
+
+def host(label):
+    return anonymizer.keyed_string(SALT, 'Host:' + label)
+
+
+@pytest.fixture
+def replacer():
+    return anonymizer.Replacer([('esx01.corp.example.com', 'FQDN'), ('esx01', 'ESX'), ('srv', 'SRV'),
+                                ('corp.example.com', 'DOMAIN')], domains=['corp.example.com'], salt=SALT)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('at web1.corp.example.com ok', 'at ' + host('web1') + '.DOMAIN ok'),
+    ('ESX01.CORP.EXAMPLE.COM', 'FQDN'),
+    ('esx02.esx01.corp.example.com', host('esx02') + '.FQDN'),
+    # A mapped value in a host label: the whole label gets its pseudonym
+    ('backup-srv.corp.example.com', host('backup-srv') + '.DOMAIN'),
+    ('a.srv.corp.example.com', host('a') + '.SRV.DOMAIN'),
+    ('srv and backup-srv.corp.example.com', 'SRV and ' + host('backup-srv') + '.DOMAIN'),
+])
+def test_host_labels(replacer, text, expected):
+    assert replacer.sub(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    # The end of a sentence, web1 is a host of the domain
+    ('Connected to web1.corp.example.com.', 'Connected to ' + host('web1') + '.DOMAIN.'),
+    # A longer domain, only the mapped value is replaced
+    ('web1.corp.example.com.au', 'web1.DOMAIN.au'),
+    ('web1.corp.example.comx', 'web1.DOMAINx'),
+    ('web1.corp.example.com-2', 'web1.DOMAIN-2'),
+])
+def test_domain_end(replacer, text, expected):
+    assert replacer.sub(text) == expected
@@ -0,0 +1,54 @@
+import codecs
+
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+LINES = ("[17.10.2026 10:00:00] <01> Info     Log has been started by 'CORP\\backup'\r\n"
+         "[17.10.2026 10:00:01] <01> Info     Job finished\r\n")
+
+CASES = {
+    'crlf': LINES.encode('utf-8'),
+    'invalid utf-8': LINES.encode('utf-8') + b'bad \xff\xfe byte\n',
+    'utf-8 bom': codecs.BOM_UTF8 + LINES.encode('utf-8'),
+    'utf-16 bom': codecs.BOM_UTF16_LE + LINES.encode('utf-16-le'),
+    'utf-16-be bom': codecs.BOM_UTF16_BE + LINES.encode('utf-16-be'),
+    'utf-16 no bom': LINES.encode('utf-16-le'),
+    # Copied while it was written
+    'utf-16 odd length': codecs.BOM_UTF16_LE + LINES.encode('utf-16-le') + b'[',
+    'utf-16 no bom odd length': LINES.encode('utf-16-le') + b'['
+}
+
+
+@pytest.fixture
+def scanner():
+    return anonymizer.load_patterns()
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+@pytest.mark.parametrize('chunk_size', [None, 100])
+@pytest.mark.parametrize('name', CASES)
+def test_round_trip(tmp_path, scanner, name, chunk_size, pipeline):
+    # Only the anonymized value differs, every other byte is written back
+    content = CASES[name]
+    log = tmp_path / 'Job.log'
+    log.write_bytes(content)
+    found = anonymizer.collect_file(scanner, str(log), chunk_size)
+    assert found['VeeamUser'] == ['CORP\\backup']
+    replacer = anonymizer.Replacer([('CORP\\backup', 'CORP\\XXXXXX')])
+    output = tmp_path / 'out.log'
+    if pipeline:
+        anonymizer.worker_state.update({'replacer': replacer, 'chunk_size': chunk_size})
+        assert list(anonymizer.anonymize_pipeline([(str(log), str(output), None, None, None, frozenset())])) == [True]
+    else:
+        anonymizer.anonymize_file(str(log), str(output), replacer, chunk_size)
+    encoding = anonymizer.log_encoding(str(log))
+    original = 'CORP\\backup'.encode(encoding)
+    assert output.read_bytes() == content.replace(original, 'CORP\\XXXXXX'.encode(encoding))
+
+
+def test_verify_odd_length(tmp_path):
+    log = tmp_path / 'Job.log'
+    log.write_bytes(CASES['utf-16 odd length'])
+    replacer = anonymizer.Replacer([('CORP\\backup', 'CORP\\XXXXXX')])
+    assert [category for _, category in anonymizer.verify_file(replacer, str(log), None)] == ['Other']
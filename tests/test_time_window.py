@@ -0,0 +1,98 @@
+import datetime
+import gzip
+
+import pytest
+
+import VeeamLogAnonymizer as anonymizer
+
+START = datetime.datetime(2026, 10, 17, 10, 0, 0)
+
+
+def key(seconds):
+    return anonymizer.time_key(START + datetime.timedelta(seconds=seconds))
+
+
+def build_log():
+    '''Lines of a log bigger than TIME_SEARCH_BLOCK and than the 1 MiB blocks
+    of a compressed log, with their key: a header and continuation lines
+    take the key of their timestamped line, a stack trace is longer than a
+    search block and several lines share each second'''
+    lines = [(b'Veeam log header\n', None)]
+    for index in range(24000):
+        moment = START + datetime.timedelta(seconds=index // 3)
+        line = moment.strftime('[%d.%m.%Y %H:%M:%S.000] <01> Info     Line ').encode() + str(index).encode() + b'\n'
+        lines.append((line, key(index // 3)))
+        if index % 50 == 0:
+            lines.append((b'    continuation of line ' + str(index).encode() + b'\n', key(index // 3)))
+        if index == 12000:
+            lines.extend((b'   at Veeam.Backup.Core.Frame' + str(frame).encode() + b'()\n', key(index // 3)) for frame in range(4000))
+    # The header goes with the first timestamped line
+    lines[0] = (lines[0][0], lines[1][1])
+    return lines
+
+
+LINES = build_log()
+
+
+def reference(since, until):
+    '''The window of a log filtered line by line'''
+    offset = 0
+    selected = []
+    for line, line_key in LINES:
+        if (since is None or line_key >= since) and (until is None or line_key <= until):
+            selected.append((offset, offset + len(line)))
+        offset += len(line)
+    return (selected[0][0], selected[-1][1]) if selected else None
+
+
+@pytest.fixture(scope='module', params=['Job.log', 'Job.log.gz'])
+def log(request, tmp_path_factory):
+    content = b''.join(line for line, _ in LINES)
+    assert len(content) > 1024 * 1024 > anonymizer.TIME_SEARCH_BLOCK
+    path = tmp_path_factory.mktemp('logs') / request.param
+    path.write_bytes(gzip.compress(content) if request.param.endswith('.gz') else content)
+    return str(path)
+
+
+@pytest.mark.parametrize('since, until', [
+    (None, None),
+    (key(-10), None),
+    (key(0), key(0)),
+    (key(1), key(1)),
+    (None, key(-1)),
+    (key(3000), None),
+    (None, key(3999)),
+    # Around the stack trace, longer than a search block
+    (key(4000), key(4000)),
+    (key(4000), key(4001)),
+    (key(4001), None),
+    (None, key(4000)),
+    (key(5000), key(6000)),
+    (key(7999), None),
+    (key(8000), None),
+    (None, key(7999)),
+])
+def test_window(log, since, until):
+    assert anonymizer.time_window(log, since, until) == reference(since, until)
+
+
+def test_bounds_between_seconds(log):
+    # The bounds fall between two seconds of the log
+    since = key(100)[:-2] + b'00'
+    assert anonymizer.time_window(log, since, key(200)) == reference(since, key(200))
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_no_timestamp(tmp_path, compressed):
+    # A log that cannot be placed in time is kept whole
+    content = b'no timestamp here\n' * 10000
+    path = tmp_path / ('plain.log.gz' if compressed else 'plain.log')
+    path.write_bytes(gzip.compress(content) if compressed else content)
+    assert anonymizer.time_window(str(path), key(0), None) == (0, len(content))
+    assert anonymizer.time_window(str(path), None, key(0)) == (0, len(content))
+
+
+def test_empty(tmp_path):
+    path = tmp_path / 'empty.log'
+    path.write_bytes(b'')
+    assert anonymizer.time_window(str(path), key(0), None) is None